@@ -18,26 +18,43 @@ copyright (c) 2009 Brush Technology. Full text of the license is here:
 
 # so you can do "from fabricate import *" to simplify your build script
 __all__ = ['ExecutionError', 'shell', 'md5_hasher', 'mtime_hasher',
-           'Runner', 'AtimesRunner', 'StraceRunner', 'AlwaysRunner',
-           'SmartRunner', 'Builder',
-           'setup', 'run', 'autoclean', 'memoize', 'outofdate', 'main']
+           'Runner', 'AtimesRunner', 'StraceRunner', 'InotifyRunner',
+           'AlwaysRunner',
+           'SmartRunner', 'Builder', 'HashCache', 'ArtifactCache', 'Tracer',
+           'setup', 'run', 'run_batch', 'after', 'autoclean', 'memoize',
+           'outofdate', 'main']
 
 # fabricate version number
 __version__ = '1.13'
 
 # if version of .deps file has changed, we know to not use it
-deps_version = 2
+deps_version = 3
+
+# likewise for the HashCache file
+hash_cache_version = 1
+
+# and for the ArtifactCache's manifests
+artifact_cache_version = 1
+
+# how much of a file md5_hasher reads at a time
+hash_chunk_size = 64*1024
 
 import atexit
+import errno
 import optparse
 import os
+import pipes
 import platform
 import re
+import select
 import shlex
+import shutil
 import stat
+import struct
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 
 FAT_atime_resolution = 24*60*60     # resolution on FAT filesystems (seconds)
@@ -63,6 +80,28 @@ except ImportError:
     import md5
     md5func = md5.new
 
+# scandir (or its backport for old Pythons) speeds up AtimesRunner's scans
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# ctypes is only needed for InotifyRunner
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+# fcntl is only needed (and available) where StraceRunner can work
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 # Use json, or pickle on older Python versions if simplejson not installed
 try:
     import json
@@ -77,6 +116,11 @@ except ImportError:
                 return cPickle.load(f)
             def dump(self, obj, f, indent=None, sort_keys=None):
                 return cPickle.dump(obj, f)
+            # these must give a single line without tabs for DepsJournal
+            def loads(self, s):
+                return cPickle.loads(s.decode('base64'))
+            def dumps(self, obj, sort_keys=None):
+                return cPickle.dumps(obj, 2).encode('base64').replace('\n', '')
         json = PickleJson()
 
 def printerr(message):
@@ -150,8 +194,17 @@ def _shell(args, input=None, silent=True, shell=False):
         command = arglist
     proc = subprocess.Popen(command, stdin=stdin, stdout=stdout,
                             stderr=subprocess.STDOUT, shell=shell)
-    output, stderr = proc.communicate(input)
-    status = proc.wait()
+    if input:
+        output, stderr = proc.communicate(input)
+    else:
+        # read the output ourselves so that _wait() can reap the process
+        output = None
+        if silent:
+            try:
+                output = proc.stdout.read()
+            finally:
+                proc.stdout.close()
+    status = _wait(proc)
     if status:
         raise ExecutionError('%r exited with status %d'
                              % (os.path.basename(arglist[0]), status),
@@ -159,12 +212,93 @@ def _shell(args, input=None, silent=True, shell=False):
     if silent:
         return output
 
+# the resource usage of the last process reaped by _wait() in each thread
+_child_rusage = threading.local()
+
+def _wait(proc):
+    """ Wait for subprocess proc to finish and return its exit status, like
+        proc.wait(). Where os.wait4() is available, the process's resource
+        usage is also kept as proc.rusage and in _child_rusage.last, for
+        Builder's trace. """
+    if proc.returncode is None and hasattr(os, 'wait4'):
+        while True:
+            try:
+                pid, status, rusage = os.wait4(proc.pid, 0)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    break           # reaped elsewhere
+                raise
+            if os.WIFSIGNALED(status):
+                proc.returncode = -os.WTERMSIG(status)
+            else:
+                proc.returncode = os.WEXITSTATUS(status)
+            proc.rusage = _child_rusage.last = rusage
+            break
+    return proc.wait()
+
+class Tracer(object):
+    """ Collects spans of time in the Trace Event Format used by Chrome's
+        about:tracing and by Perfetto, and writes them to the JSON file
+        "filename". """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._start = time.time()
+        self._pid = os.getpid()
+        self._events = []
+        self._lock = threading.Lock()
+
+    def add(self, name, category, begin, end=None, args=None):
+        """ Add a span named name from time.time() values begin to end (or
+            now), with a dict of args to show with it. """
+        if end is None:
+            end = time.time()
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int((begin - self._start) * 1000000),
+            'dur': int((end - begin) * 1000000),
+            'pid': self._pid,
+            'tid': threading.currentThread().ident,
+        }
+        if args:
+            event['args'] = args
+        self._lock.acquire()
+        try:
+            self._events.append(event)
+        finally:
+            self._lock.release()
+
+    def write(self, filename=None):
+        """ Write the trace collected so far. """
+        if filename is None:
+            filename = self.filename
+        self._lock.acquire()
+        try:
+            events = list(self._events)
+        finally:
+            self._lock.release()
+        f = open(filename, 'w')
+        try:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        finally:
+            f.close()
+
 def md5_hasher(filename):
     """ Return MD5 hash of given filename, or None if file doesn't exist. """
     try:
         f = open(filename, 'rb')
         try:
-            return md5func(f.read()).hexdigest()
+            md5 = md5func()
+            while True:
+                chunk = f.read(hash_chunk_size)
+                if not chunk:
+                    break
+                md5.update(chunk)
+            return md5.hexdigest()
         finally:
             f.close()
     except IOError:
@@ -178,12 +312,500 @@ def mtime_hasher(filename):
     except (IOError, OSError):
         return None
 
+class HashCache(object):
+    """ Wraps a hasher, remembering the hash of each file along with its
+        stat signature (inode, size, modification and change times) in the
+        JSON file "filename". A file is only read and hashed again when its
+        signature changes, so checking an unchanged file costs one stat(). """
+
+    # Files changed this recently (in seconds) aren't cached, because a
+    # further change might not alter their modification time
+    racy_window = FAT_mtime_resolution
+
+    def __init__(self, filename, hasher=md5_hasher):
+        self.filename = filename
+        self.hasher = hasher
+        self._entries = None
+        self._changed = False
+
+    def __call__(self, filename):
+        """ Return the hasher's result for filename. """
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        signature = [st.st_ino, st.st_size, st.st_mtime, st.st_ctime]
+
+        entries = self.entries
+        entry = entries.get(filename)
+        if entry is not None and entry[:4] == signature:
+            return entry[4]
+
+        hashed = self.hasher(filename)
+        if hashed is None:
+            entries.pop(filename, None)
+        elif max(st.st_mtime, st.st_ctime) < time.time() - self.racy_window:
+            entries[filename] = signature + [hashed]
+            self._changed = True
+        return hashed
+
+    @property
+    def entries(self):
+        """ Lazy load the cache file. """
+        if self._entries is None:
+            self.read()
+        return self._entries
+
+    def read(self):
+        """ Read the cache file, ignoring it if it was written for another
+            hasher or cache version. """
+        self._entries = {}
+        try:
+            f = open(self.filename)
+            try:
+                entries = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return
+        if entries.pop('.hash_cache_version', None) == hash_cache_version and \
+           entries.pop('.hasher', None) == self.hasher.__name__:
+            self._entries = entries
+
+    def clear(self):
+        """ Forget all cached hashes without writing the cache file. """
+        self._entries = {}
+        self._changed = False
+
+    def write(self, filename=None):
+        """ Write the cache file if any hashes were added. """
+        if self._entries is None or not self._changed:
+            return
+        if filename is None:
+            filename = self.filename
+        entries = dict(self._entries)
+        entries['.hash_cache_version'] = hash_cache_version
+        entries['.hasher'] = self.hasher.__name__
+        f = open(filename, 'w')
+        try:
+            json.dump(entries, f, sort_keys=True)
+        finally:
+            f.close()
+        self._changed = False
+
+class DepsJournal(object):
+    """ The dependencies of each command, as a dict-like object stored in
+        the append-only journal file "filename". After a version header, each
+        line of the file is a record of one command's dependencies, written
+        as soon as the command finishes, and later records replace earlier
+        ones. So an interrupted build keeps the work it did, and saving costs
+        only the commands that ran. Records are only decoded when their
+        command is looked up. """
+
+    def __init__(self, filename):
+        # absolute so that changing directory doesn't lose the file
+        self.filename = os.path.abspath(filename)
+        self.bad_version = False
+        self._raw = {}          # {command: undecoded record}
+        self._decoded = {}      # {command: {dep: hash}}
+        self._records = 0       # records in the file, including replaced ones
+        self._end = None        # end of the header or last whole record
+        self._file = None
+        self.read()
+
+    def read(self):
+        """ Index the records in the file by command. A partial record left
+            by an interrupted write is dropped. """
+        try:
+            f = open(self.filename, 'rb')
+        except IOError:
+            return
+        try:
+            line = f.readline()
+            try:
+                header = json.loads(line)
+            except ValueError:
+                header = None
+            if not line.endswith('\n'):
+                header = None
+            if not isinstance(header, dict) or \
+               header.get('.deps_version') != deps_version:
+                self.bad_version = True
+                return
+            self._end = f.tell()
+            while True:
+                line = f.readline()
+                if not line.endswith('\n'):
+                    break
+                key, sep, record = line.partition('\t')
+                if not sep:
+                    break
+                try:
+                    command = json.loads(key)
+                except ValueError:
+                    break
+                self._decoded.pop(command, None)
+                self._raw[command] = record
+                self._records += 1
+                self._end = f.tell()
+        finally:
+            f.close()
+
+    def __contains__(self, command):
+        return command in self._decoded or command in self._raw
+
+    def __len__(self):
+        return len(self._decoded) + len(self._raw)
+
+    def __getitem__(self, command):
+        try:
+            return self._decoded[command]
+        except KeyError:
+            deps = json.loads(self._raw.pop(command))
+            self._decoded[command] = deps
+            return deps
+
+    def __setitem__(self, command, deps):
+        self._raw.pop(command, None)
+        self._decoded[command] = deps
+        self._append(command, deps)
+
+    def items(self):
+        return [(command, self[command]) for command in self.keys()]
+
+    def keys(self):
+        return self._decoded.keys() + self._raw.keys()
+
+    def _record(self, command):
+        """ Return the journal line for command. """
+        if command in self._raw:
+            record = self._raw[command]
+        else:
+            record = json.dumps(self._decoded[command], sort_keys=True) + '\n'
+        return json.dumps(command) + '\t' + record
+
+    def _append(self, command, deps):
+        if self._file is None:
+            if self._end is None:
+                # no usable file yet, so start a new one
+                self._file = open(self.filename, 'wb')
+                self._file.write(self._header())
+                self._records = 0
+            else:
+                self._file = open(self.filename, 'r+b')
+                self._file.seek(self._end)
+                self._file.truncate()
+        self._file.write(self._record(command))
+        self._file.flush()
+        self._records += 1
+        self._end = self._file.tell()
+
+    def _header(self):
+        return json.dumps({'.deps_version': deps_version}) + '\n'
+
+    def close(self):
+        """ Close the file, compacting it if most of its records have been
+            replaced by later ones. """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._records > 2 * len(self):
+            self.write()
+
+    def write(self, filename=None):
+        """ Write a compacted journal with one record per command to
+            filename (default is this journal's file). It's written to a
+            temporary file first, so a crash can't lose the old one. """
+        if filename is None:
+            filename = self.filename
+        filename = os.path.abspath(filename)
+        if filename == self.filename and self._file is not None:
+            self._file.close()
+            self._file = None
+        tempname = filename + '.tmp'
+        f = open(tempname, 'wb')
+        try:
+            try:
+                f.write(self._header())
+                for command in sorted(self.keys()):
+                    f.write(self._record(command))
+            finally:
+                f.close()
+            os.rename(tempname, filename)
+        except:
+            os.remove(tempname)
+            raise
+        if filename == self.filename:
+            self._records = len(self)
+            self._end = os.path.getsize(filename)
+
+    def discard(self):
+        """ Close the file without compacting it, for instance before it's
+            deleted. """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._records = 0
+
+class ArtifactCache(object):
+    """ A content-addressed cache of command outputs, like ccache, kept in
+        the directory "path". Several builds can share it, such as the
+        worktrees of one repository, because files in the build directory
+        are recorded by their paths relative to it. Files outside it (such
+        as system libraries, if the runner reports them) are recorded by
+        absolute path, so their entries only match on machines where those
+        files have the same hashes.
+
+        Each command line has a manifest listing the inputs and outputs of
+        the last few times it was run. An output is stored once in objects/
+        under its MD5 sum. A command that is out of date is looked up before
+        it runs, and if the hashes of all of an entry's inputs match the
+        files now, the entry's outputs are copied back instead of running it.
+
+        Once the cache is bigger than "max_size" bytes, the least recently
+        used files are removed until it's below 90% of that. Files are
+        touched when they're used, so their mtimes give the order. Hit, miss
+        and store counts are kept in a "stats" file, updated under a lock
+        when the build finishes. """
+
+    # entries kept in each manifest, newest first
+    max_entries = 10
+
+    def __init__(self, path, max_size=1024**3):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._counts = {}       # changes to the stats counters not written
+
+    def _manifest_name(self, command):
+        key = md5func(repr((artifact_cache_version, command))).hexdigest()
+        return os.path.join(self.path, 'manifests', key[:2], key[2:])
+
+    def _object_name(self, hashed):
+        return os.path.join(self.path, 'objects', hashed[:2], hashed[2:])
+
+    def _count(self, name, n=1):
+        self._lock.acquire()
+        try:
+            self._counts[name] = self._counts.get(name, 0) + n
+        finally:
+            self._lock.release()
+
+    def lookup(self, command, hasher):
+        """ Find a run of command whose inputs all still have the hashes
+            given by hasher, and copy its outputs back into place. Return its
+            entry, {'inputs': {file: hash}, 'outputs': {file: hash}}, or
+            None if there isn't one. """
+        manifest = self._read_manifest(command)
+        for entry in manifest:
+            for dep, hashed in entry['inputs'].items():
+                if hasher(dep) != hashed:
+                    break
+            else:
+                if self._restore(entry['outputs']):
+                    _touch(self._manifest_name(command))
+                    self._count('hits')
+                    return entry
+        self._count('misses')
+        return None
+
+    def _restore(self, outputs):
+        """ Copy the objects for outputs ({output: hash}) into place, or
+            return False if any of them has been evicted. """
+        for hashed in outputs.values():
+            if not os.path.exists(self._object_name(hashed)):
+                return False
+        for output, hashed in outputs.items():
+            objname = self._object_name(hashed)
+            _touch(objname)
+            dirname = os.path.dirname(output)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            _copy_file(objname, output)
+        return True
+
+    def store(self, command, deps):
+        """ Save the outputs listed in deps (a .deps entry, {file: 'input-'
+            or 'output-' hash}) as the result of command. Commands without
+            outputs aren't stored, since there'd be nothing to restore. """
+        inputs = {}
+        outputs = {}
+        for dep, hashed in deps.items():
+            dep = _build_path(dep)
+            kind, hashed = hashed.split('-', 1)
+            if kind == 'input':
+                inputs[dep] = hashed
+            else:
+                outputs[dep] = hashed
+        if not outputs:
+            return
+
+        added = 0
+        for output, hashed in outputs.items():
+            objname = self._object_name(hashed)
+            if os.path.exists(objname):
+                _touch(objname)
+            else:
+                added += self._write_file(objname, output)
+        entry = {'inputs': inputs, 'outputs': outputs}
+        manifest = [e for e in self._read_manifest(command)
+                    if e['inputs'] != inputs]
+        manifest.insert(0, entry)
+        data = json.dumps(manifest[:self.max_entries], sort_keys=True)
+        added += self._write_file(self._manifest_name(command), data=data)
+        self._count('stores')
+        self._count('size', added)
+
+    def _read_manifest(self, command):
+        try:
+            f = open(self._manifest_name(command))
+            try:
+                return json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return []
+
+    def _write_file(self, filename, source=None, data=None):
+        """ Write data (or a copy of the file source) to filename by way of
+            a temporary file, so other builds never see part of it. Return
+            the change in the cache's size. """
+        dirname = os.path.dirname(filename)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                pass                    # another build made it first
+        try:
+            old_size = os.path.getsize(filename)
+        except OSError:
+            old_size = 0
+        handle, tempname = tempfile.mkstemp(dir=dirname)
+        try:
+            os.close(handle)
+            if source is None:
+                f = open(tempname, 'wb')
+                try:
+                    f.write(data)
+                finally:
+                    f.close()
+            else:
+                _copy_file(source, tempname)
+            os.rename(tempname, filename)
+        except:
+            os.remove(tempname)
+            raise
+        return os.path.getsize(filename) - old_size
+
+    def stats(self):
+        """ Return the cache's statistics (including this build's so far)
+            as a dict of counters. """
+        stats = self._read_stats()
+        self._lock.acquire()
+        try:
+            counts = self._counts.items()
+        finally:
+            self._lock.release()
+        for name, n in counts:
+            stats[name] = stats.get(name, 0) + n
+        return stats
+
+    def _read_stats(self):
+        try:
+            f = open(os.path.join(self.path, 'stats'))
+            try:
+                stats = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            stats = {}
+        for name in ('hits', 'misses', 'stores', 'evictions', 'size'):
+            stats.setdefault(name, 0)
+        return stats
+
+    def write(self):
+        """ Add this build's counts to the stats file, evicting the least
+            recently used files first if the cache has grown too big. """
+        if not self._counts:
+            return
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        lock = open(os.path.join(self.path, 'lock'), 'w')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            stats = self.stats()
+            if stats['size'] > self.max_size:
+                evicted, stats['size'] = self._evict(self.max_size * 9 // 10)
+                stats['evictions'] += evicted
+            data = json.dumps(stats, sort_keys=True)
+            self._write_file(os.path.join(self.path, 'stats'), data=data)
+            self._counts = {}
+        finally:
+            lock.close()
+
+    def _evict(self, target):
+        """ Remove the least recently used manifests and objects until the
+            cache is no bigger than target bytes. Return (files removed, new
+            size). Entries whose objects are gone are skipped by lookup(). """
+        files = []
+        for subdir in ('manifests', 'objects'):
+            for dirpath, dirnames, filenames in \
+                    os.walk(os.path.join(self.path, subdir)):
+                for filename in filenames:
+                    filename = os.path.join(dirpath, filename)
+                    try:
+                        st = os.stat(filename)
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, filename))
+        files.sort()
+        size = sum(size for mtime, size, filename in files)
+        evicted = 0
+        for mtime, filesize, filename in files:
+            if size <= target:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            size -= filesize
+            evicted += 1
+        return evicted, size
+
+def _build_path(filename):
+    """ Return filename relative to the build directory if it's inside it,
+        otherwise as an absolute path. """
+    fullname = os.path.abspath(filename)
+    cwd = os.getcwd()
+    if fullname.startswith(cwd + os.sep):
+        return fullname[len(cwd + os.sep):]
+    return fullname
+
+def _touch(filename):
+    """ Mark a cache file as just used. """
+    try:
+        os.utime(filename, None)
+    except OSError:
+        pass
+
+def _copy_file(source, dest):
+    """ Copy the contents of source to dest. The file is replaced rather than
+        written in place, in case it's hard linked or being read. """
+    if os.path.exists(dest):
+        os.remove(dest)
+    shutil.copyfile(source, dest)
+
 class RunnerUnsupportedException(Exception):
     """ Exception raise by Runner constructor if it is not supported
         on the current platform."""
     pass
 
 class Runner(object):
+    # True if the runner can run several commands at once and still tell
+    # their dependencies apart (see Builder's "jobs" option)
+    parallel_ok = False
+
     def __call__(self, *args):
         """ Run command and return (dependencies, outputs), where
             dependencies is a list of the filenames of files that the
@@ -198,6 +820,8 @@ class Runner(object):
 class AtimesRunner(Runner):
     def __init__(self, builder):
         self._builder = builder
+        # {dir path: (mtime, time listed, subdirectory names, file names)}
+        self._listings = {}
         self.atimes = AtimesRunner.has_atimes(self._builder.dirs)
         if self.atimes == 0:
             raise RunnerUnsupportedException(
@@ -290,28 +914,81 @@ class AtimesRunner(Runner):
                 os.remove(filename)
         return atimes
 
+    def _list_dir(self, path):
+        """ Return (subdirectory names, file names) for directory path,
+            reusing the last listing if the directory hasn't changed since.
+            A directory's mtime changes when names are added or removed, but
+            not when its files change, so the files still need a stat(). """
+        mtime = os.stat(path).st_mtime
+        listing = self._listings.get(path)
+        if listing is not None and listing[0] == mtime:
+            return listing[2], listing[3]
+
+        subdirs = []
+        files = []
+        if scandir is not None:
+            for entry in scandir(path):
+                try:
+                    if entry.is_dir():
+                        subdirs.append(entry.name)
+                    elif entry.is_file():
+                        files.append(entry.name)
+                except OSError:
+                    pass            # dangling symlink or already removed
+        else:
+            for name in os.listdir(path):
+                try:
+                    mode = os.stat(os.path.join(path, name)).st_mode
+                except OSError:
+                    continue        # dangling symlink or already removed
+                if stat.S_ISDIR(mode):
+                    subdirs.append(name)
+                elif stat.S_ISREG(mode):
+                    files.append(name)
+
+        # The listing can't be trusted if the directory changed so recently
+        # that another change might not alter its mtime.
+        scanned = time.time()
+        if mtime < scanned - FAT_mtime_resolution:
+            self._listings[path] = (mtime, scanned, subdirs, files)
+        else:
+            self._listings.pop(path, None)
+        return subdirs, files
+
     def _file_times(self, path, depth):
         """ Helper function for file_times().
             Return a dict of file times, recursing directories that don't
             start with self._builder.ignoreprefix """
 
         AtimesRunner.exists(path)
-        names = os.listdir(path)
+        subdirs, files = self._list_dir(path)
         times = {}
         ignoreprefix = self._builder.ignoreprefix
-        for name in names:
+        for name in files:
             if ignoreprefix and name.startswith(ignoreprefix):
                 continue
             if path == '.':
                 fullname = name
             else:
                 fullname = os.path.join(path, name)
-            st = os.stat(fullname)
-            if stat.S_ISDIR(st.st_mode):
-                if depth > 1:
-                    times.update(self._file_times(fullname, depth-1))
-            elif stat.S_ISREG(st.st_mode):
+            try:
+                st = os.stat(fullname)
+            except OSError:
+                continue            # removed since the listing
+            if stat.S_ISREG(st.st_mode):
                 times[fullname] = st.st_atime, st.st_mtime
+        if depth > 1:
+            for name in subdirs:
+                if ignoreprefix and name.startswith(ignoreprefix):
+                    continue
+                if path == '.':
+                    fullname = name
+                else:
+                    fullname = os.path.join(path, name)
+                try:
+                    times.update(self._file_times(fullname, depth-1))
+                except (OSError, PathError):
+                    pass            # removed since the listing
         return times
 
     def file_times(self):
@@ -358,6 +1035,7 @@ class AtimesRunner(Runner):
         old_stat_float = os.stat_float_times()
         os.stat_float_times(True)
 
+        begin = self._builder.trace_begin()
         originals = self.file_times()
         if self.atimes == 2:
             befores = originals
@@ -367,7 +1045,11 @@ class AtimesRunner(Runner):
             befores = self._age_atimes(originals)
             atime_resolution = FAT_atime_resolution
             mtime_resolution = FAT_mtime_resolution
+        self._builder.trace_end('scan before', 'runner', begin)
+        begin = self._builder.trace_begin()
         shell(*args, **dict(silent=False))
+        self._builder.trace_end('execute', 'command', begin)
+        begin = self._builder.trace_begin()
         afters = self.file_times()
         deps = []
         outputs = []
@@ -400,6 +1082,7 @@ class AtimesRunner(Runner):
                 original = originals[name]
                 if original != afters.get(name, None):
                     self._utime(name, original[0], original[1])
+        self._builder.trace_end('scan after', 'runner', begin)
 
         os.stat_float_times(old_stat_float)  # restore stat_float_times value
         return deps, outputs
@@ -422,16 +1105,16 @@ class StraceProcess(object):
 
 class StraceRunner(Runner):
     keep_temps = False
+    parallel_ok = True
+    _temp_lock = threading.Lock()
 
     def __init__(self, builder):
         self.strace_version = StraceRunner.get_strace_version()
         if self.strace_version == 0:
             raise RunnerUnsupportedException('strace is not available')
         if self.strace_version == 32:
-            self._stat_re = self._stat32_re
             self._stat_func = 'stat'
         else:
-            self._stat_re = self._stat64_re
             self._stat_func = 'stat64'
         self._builder = builder
         self.temp_count = 0
@@ -454,17 +1137,18 @@ class StraceRunner(Runner):
         except OSError:
             return 0
 
-    # Regular expressions for parsing of strace log
-    _open_re       = re.compile(r'(?P<pid>\d+)\s+open\("(?P<name>[^"]*)", (?P<mode>[^,)]*)')
-    _stat32_re     = re.compile(r'(?P<pid>\d+)\s+stat\("(?P<name>[^"]*)", .*')
-    _stat64_re     = re.compile(r'(?P<pid>\d+)\s+stat64\("(?P<name>[^"]*)", .*')
-    _execve_re     = re.compile(r'(?P<pid>\d+)\s+execve\("(?P<name>[^"]*)", .*')
-    _mkdir_re      = re.compile(r'(?P<pid>\d+)\s+mkdir\("(?P<name>[^"]*)", .*')
-    _rename_re     = re.compile(r'(?P<pid>\d+)\s+rename\("[^"]*", "(?P<name>[^"]*)"\)')
+    # Regular expression for parsing of strace log: each line is split into
+    # the pid, the system call name and the call's arguments and result,
+    # which are then parsed according to the system call
+    _syscall_re    = re.compile(r'(?P<pid>\d+)\s+(?P<call>\w+)\((?P<args>.*)')
     _kill_re       = re.compile(r'(?P<pid>\d+)\s+killed by.*')
-    _chdir_re      = re.compile(r'(?P<pid>\d+)\s+chdir\("(?P<cwd>[^"]*)"\)')
-    _exit_group_re = re.compile(r'(?P<pid>\d+)\s+exit_group\((?P<status>.*)\).*')
-    _clone_re      = re.compile(r'(?P<pid_clone>\d+)\s+(clone|fork|vfork)\(.*\)\s*=\s*(?P<pid>\d*)')
+
+    # Regular expressions for the arguments of each system call
+    _name_re       = re.compile(r'"(?P<name>[^"]*)", (?P<mode>[^,)]*)')
+    _rename_re     = re.compile(r'"[^"]*", "(?P<name>[^"]*)"\)')
+    _chdir_re      = re.compile(r'"(?P<cwd>[^"]*)"\)')
+    _exit_group_re = re.compile(r'(?P<status>.*)\).*')
+    _clone_re      = re.compile(r'.*\)\s*=\s*(?P<pid>\d*)')
 
     # Regular expressions for detecting interrupted lines in strace log
     # 3618  clone( <unfinished ...>
@@ -472,17 +1156,83 @@ class StraceRunner(Runner):
     _unfinished_start_re = re.compile(r'(?P<pid>\d+)(?P<body>.*)<unfinished ...>$')
     _unfinished_end_re   = re.compile(r'(?P<pid>\d+)\s+\<\.\.\..*\>(?P<body>.*)')
 
-    def _do_strace(self, args, outfile, outname):
-        """ Run strace on given command args, sending output to file.
-            Return (status code, list of dependencies, list of outputs). """
-        shell('strace', '-fo', outname, '-e',
-              'trace=open,%s,execve,exit_group,chdir,mkdir,rename,clone,vfork,fork' % self._stat_func,
-              args, silent=False)
-        cwd = '.' 
+    def _do_strace(self, args, fifoname, keepfile=None):
+        """ Run strace on given command args, reading its output through the
+            named pipe fifoname while the command runs, and copying it to
+            keepfile if given. Return (status code, list of dependencies,
+            list of outputs). """
+        # Open both ends of the pipe before strace starts. Otherwise reading
+        # would either see end of file before strace opened it, or block
+        # forever if strace failed to start. Our end for writing is closed
+        # when strace exits, so reading then sees end of file.
+        read_fd = os.open(fifoname, os.O_RDONLY | os.O_NONBLOCK)
+        try:
+            write_fd = os.open(fifoname, os.O_WRONLY)
+        except:
+            os.close(read_fd)
+            raise
+        for fd in (read_fd, write_fd):
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        flags = fcntl.fcntl(read_fd, fcntl.F_GETFL)
+        fcntl.fcntl(read_fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+
+        infile = os.fdopen(read_fd, 'r')
+        try:
+            try:
+                proc = subprocess.Popen(
+                    ['strace', '-f', '-o', fifoname, '-e',
+                     'trace=open,%s,execve,exit_group,chdir,mkdir,rename,clone,vfork,fork' % self._stat_func]
+                    + args_to_list(args),
+                    stderr=subprocess.STDOUT, close_fds=True)
+            except:
+                os.close(write_fd)
+                raise
+            waiter = threading.Thread(target=self._close_on_exit,
+                                      args=(proc, write_fd))
+            waiter.start()
+            begin = self._builder.trace_begin()
+            try:
+                try:
+                    result = self._parse_strace(infile, keepfile)
+                except Exception:
+                    # strace blocks once the pipe is full, so keep reading
+                    # until it finishes or the wait below never ends.
+                    error = sys.exc_info()
+                    for line in iter(infile.readline, ''):
+                        pass
+                    raise error[0], error[1], error[2]
+            finally:
+                waiter.join()
+                _child_rusage.last = getattr(proc, 'rusage', None)
+            self._builder.trace_end('execute and parse strace', 'command',
+                                    begin)
+        finally:
+            infile.close()
+
+        if proc.returncode:
+            raise ExecutionError('%r exited with status %d'
+                                 % ('strace', proc.returncode),
+                                 '', proc.returncode)
+        return result
+
+    @staticmethod
+    def _close_on_exit(proc, fd):
+        _wait(proc)
+        os.close(fd)
+
+    def _parse_strace(self, infile, keepfile=None):
+        """ Parse strace output from infile as it arrives. Return (status
+            code, list of dependencies, list of outputs), or (None, None,
+            None) if a process was killed. """
+        stat_func = self._stat_func
+        killed = False
         status = 0
         processes  = {}  # dictionary of processes (key = pid)
         unfinished = {}  # list of interrupted entries in strace log
-        for line in outfile:
+        for line in iter(infile.readline, ''):
+            if keepfile is not None:
+                keepfile.write(line)
+
             # look for split lines
             unfinished_start_match = self._unfinished_start_re.match(line)
             unfinished_end_match = self._unfinished_end_re.match(line)
@@ -494,70 +1244,71 @@ class StraceRunner(Runner):
             elif unfinished_end_match:
                 pid = unfinished_end_match.group('pid')
                 body = unfinished_end_match.group('body')
-                line = unfinished[pid] + body
-                del unfinished[pid]
-
-            is_output = False
-            open_match = self._open_re.match(line)
-            stat_match = self._stat_re.match(line)
-            execve_match = self._execve_re.match(line)
-            mkdir_match = self._mkdir_re.match(line)
-            rename_match = self._rename_re.match(line)
-            clone_match = self._clone_re.match(line)  
+                if pid not in unfinished:
+                    # the start of the call was never seen
+                    continue
+                line = unfinished.pop(pid) + body
 
-            kill_match = self._kill_re.match(line)
-            if kill_match:
-                return None, None, None
+            syscall_match = self._syscall_re.match(line)
+            if not syscall_match:
+                if self._kill_re.match(line):
+                    killed = True
+                continue
+            pid = syscall_match.group('pid')
+            call = syscall_match.group('call')
+            args = syscall_match.group('args')
+            # A child's lines can arrive before its parent's clone line.
+            # Then it gets a process of its own, in the starting directory.
+            if pid not in processes and call != 'execve':
+                processes[pid] = StraceProcess()
 
+            is_output = False
             match = None
-            if execve_match:
-                pid = execve_match.group('pid')
+            if call == 'open':
+                match = self._name_re.match(args)
+                if match:
+                    mode = match.group('mode')
+                    if 'O_WRONLY' in mode or 'O_RDWR' in mode:
+                        # it's an output file if opened for writing
+                        is_output = True
+            elif call == stat_func or call == 'mkdir':
+                match = self._name_re.match(args)
+            elif call == 'execve':
                 if pid not in processes:
                     processes[pid] = StraceProcess()
-                    match = execve_match
-            elif clone_match:
-                pid = clone_match.group('pid')
-                pid_clone = clone_match.group('pid_clone')
-                processes[pid] = StraceProcess(processes[pid_clone].cwd)
-            elif open_match:
-                match = open_match
-                mode = match.group('mode')
-                if 'O_WRONLY' in mode or 'O_RDWR' in mode:
-                    # it's an output file if opened for writing
-                    is_output = True
-            elif stat_match:
-                match = stat_match
-            elif mkdir_match:
-                match = mkdir_match                
-            elif rename_match:
-                match = rename_match
+                    match = self._name_re.match(args)
+            elif call == 'rename':
+                match = self._rename_re.match(args)
                 # the destination of a rename is an output file
                 is_output = True
-                
+            elif call in ('clone', 'fork', 'vfork'):
+                clone_match = self._clone_re.match(args)
+                if clone_match:
+                    child = clone_match.group('pid')
+                    if child not in processes:
+                        processes[child] = StraceProcess(processes[pid].cwd)
+            elif call == 'chdir':
+                chdir_match = self._chdir_re.match(args)
+                if chdir_match:
+                    processes[pid].cwd = os.path.join(processes[pid].cwd,
+                                                      chdir_match.group('cwd'))
+            elif call == 'exit_group':
+                exit_match = self._exit_group_re.match(args)
+                if exit_match:
+                    status = int(exit_match.group('status'))
+
             if match:
                 name = match.group('name')
-                pid  = match.group('pid')
                 cwd = processes[pid].cwd
                 if cwd != '.':
                     name = os.path.join(cwd, name)
+                if is_output:
+                    processes[pid].add_output(name)
+                else:
+                    processes[pid].add_dep(name)
 
-                if (self._builder._is_relevant(name)
-                    and not self.ignore(name)
-                    and (os.path.isfile(name)
-                         or os.path.isdir(name)
-                         or not os.path.lexists(name))):
-                    if is_output:
-                        processes[pid].add_output(name)
-                    else:
-                        processes[pid].add_dep(name)
-
-            match = self._chdir_re.match(line)
-            if match:
-                processes[pid].cwd = os.path.join(processes[pid].cwd, match.group('cwd'))
-
-            match = self._exit_group_re.match(line)
-            if match:
-                status = int(match.group('status'))
+        if killed:
+            return None, None, None
 
         # collect outputs and dependencies from all processes
         deps = set()
@@ -566,35 +1317,57 @@ class StraceRunner(Runner):
             deps = deps.union(process.deps)
             outputs = outputs.union(process.outputs)
 
+        # files are checked once the command has finished, and only once
+        checked = {}
+        for names in (deps, outputs):
+            for name in list(names):
+                if name not in checked:
+                    checked[name] = self._wanted(name)
+                if not checked[name]:
+                    names.discard(name)
+
         return status, list(deps), list(outputs)
 
+    def _wanted(self, name):
+        """ Return True if name is a relevant file or directory, or doesn't
+            exist (like a deleted temporary file). """
+        if not self._builder._is_relevant(name) or self.ignore(name):
+            return False
+        try:
+            mode = os.stat(name).st_mode
+        except OSError:
+            # a dangling symlink isn't wanted
+            return not os.path.lexists(name)
+        return stat.S_ISREG(mode) or stat.S_ISDIR(mode)
+
     def __call__(self, *args):
         """ Run command and return its dependencies and outputs, using strace
             to determine dependencies (by looking at what files are opened or
             modified). """
+        keepfile = None
         if self.keep_temps:
-            outname = 'strace%03d.txt' % self.temp_count
-            self.temp_count += 1
-            handle = os.open(outname, os.O_CREAT)
-        else:
-            handle, outname = tempfile.mkstemp()
-
-        try:
-            try:
-                outfile = os.fdopen(handle, 'r')
-            except:
-                os.close(handle)
-                raise
+            self._temp_lock.acquire()
             try:
-                status, deps, outputs = self._do_strace(args, outfile, outname)
-                if status is None:
-                    raise ExecutionError(
-                        '%r was killed unexpectedly' % args[0], '', -1)
+                outname = 'strace%03d.txt' % self.temp_count
+                self.temp_count += 1
             finally:
-                outfile.close()
+                self._temp_lock.release()
+            keepfile = open(outname, 'w')
+
+        tempdir = tempfile.mkdtemp()
+        fifoname = os.path.join(tempdir, 'strace')
+        try:
+            os.mkfifo(fifoname)
+            status, deps, outputs = self._do_strace(args, fifoname, keepfile)
+            if status is None:
+                raise ExecutionError(
+                    '%r was killed unexpectedly' % args[0], '', -1)
         finally:
-            if not self.keep_temps:
-                os.remove(outname)
+            if keepfile is not None:
+                keepfile.close()
+            if os.path.exists(fifoname):
+                os.remove(fifoname)
+            os.rmdir(tempdir)
 
         if status:
             raise ExecutionError('%r exited with status %d'
@@ -602,14 +1375,224 @@ class StraceRunner(Runner):
                                  '', status)
         return list(deps), list(outputs)
 
+class InotifyRunner(Runner):
+    """ Runner that uses Linux's inotify (through ctypes) to see which files
+        in the builder's dirs a command opens, modifies or creates. The dirs
+        are only walked once, to watch them, so a command costs about as much
+        as the files it touches, and unlike StraceRunner the command isn't
+        slowed down. Events from other processes can't be told apart, so
+        commands can't run in parallel. """
+
+    # from <sys/inotify.h>
+    IN_MODIFY      = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_OPEN        = 0x00000020
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_Q_OVERFLOW  = 0x00004000
+    IN_IGNORED     = 0x00008000
+    IN_ISDIR       = 0x40000000
+    IN_CLOEXEC     = 0x00080000
+    IN_NONBLOCK    = 0x00000800
+
+    _mask = IN_OPEN | IN_MODIFY | IN_CLOSE_WRITE | IN_CREATE | IN_MOVED_TO
+    _event = struct.Struct('iIII')  # wd, mask, cookie, len (then the name)
+
+    def __init__(self, builder):
+        self._builder = builder
+        if ctypes is None or platform.system() != 'Linux':
+            raise RunnerUnsupportedException('inotify is not available')
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            self._fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        except (OSError, AttributeError):
+            raise RunnerUnsupportedException('inotify is not available')
+        if self._fd < 0:
+            raise RunnerUnsupportedException(
+                'inotify is not available: %s'
+                % os.strerror(ctypes.get_errno()))
+        self._watches = {}      # {watch descriptor: (path, depth)}
+        self._watched = None    # the builder settings the watches are for
+        # written to when the command finishes, to wake _watch_events()
+        self._wake_read, self._wake_write = os.pipe()
+        for fd in (self._wake_read, self._wake_write):
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        self._reset()
+
+    def _reset(self):
+        """ Forget the files seen so far. """
+        self._opened = set()
+        self._modified = set()
+        self._created = set()
+        self._overflow = False
+
+    def _update_watches(self):
+        """ Watch the builder's dirs, unless they're already watched. """
+        builder = self._builder
+        watched = (list(builder.dirs), builder.dirdepth, builder.ignoreprefix)
+        if watched == self._watched:
+            return
+        for wd in self._watches:
+            self._rm_watch(self._fd, wd)
+        self._watches = {}
+        for path in builder.dirs:
+            AtimesRunner.exists(path)
+            self._watch_tree(path, builder.dirdepth)
+        self._watched = watched
+
+    def _watch_tree(self, path, depth, created=None):
+        """ Watch directory path and its subdirectories that don't start
+            with ignoreprefix, to the given depth (as AtimesRunner scans
+            them). For a directory made by the command, "created" is a set
+            to add the files already in it to. """
+        wd = self._add_watch(self._fd, path, self._mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if created is not None and err == errno.ENOENT:
+                return              # already removed again
+            raise OSError(err, "can't watch %s: %s"
+                               % (path, os.strerror(err)))
+        self._watches[wd] = (path, depth)
+
+        try:
+            names = os.listdir(path)
+        except OSError:
+            if created is not None:
+                return
+            raise
+        ignoreprefix = self._builder.ignoreprefix
+        for name in names:
+            if ignoreprefix and name.startswith(ignoreprefix):
+                continue
+            if path == '.':
+                fullname = name
+            else:
+                fullname = os.path.join(path, name)
+            try:
+                st = os.stat(fullname)
+            except OSError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                if depth > 1:
+                    self._watch_tree(fullname, depth-1, created)
+            elif stat.S_ISREG(st.st_mode) and created is not None:
+                created.add(fullname)
+
+    def _read_events(self):
+        """ Return a list of (wd, mask, name) for the queued events. """
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, 64*1024)
+            except OSError, e:
+                if e.errno == errno.EAGAIN:
+                    break
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self._event.unpack_from(data, offset)
+                offset += self._event.size
+                events.append((wd, mask, data[offset:offset+length].rstrip('\0')))
+                offset += length
+        return events
+
+    def _handle_events(self):
+        """ Sort the queued events into opened, modified and created files,
+            and watch new directories. """
+        ignoreprefix = self._builder.ignoreprefix
+        for wd, mask, name in self._read_events():
+            if mask & self.IN_Q_OVERFLOW:
+                self._overflow = True
+                continue
+            if mask & self.IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            watch = self._watches.get(wd)
+            if watch is None or not name:
+                continue
+            if ignoreprefix and name.startswith(ignoreprefix):
+                continue
+            path, depth = watch
+            if path == '.':
+                fullname = name
+            else:
+                fullname = os.path.join(path, name)
+
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO) and depth > 1:
+                    self._watch_tree(fullname, depth-1, self._created)
+                continue
+            if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self._created.add(fullname)
+            if mask & (self.IN_MODIFY | self.IN_CLOSE_WRITE):
+                self._modified.add(fullname)
+            if mask & self.IN_OPEN:
+                self._opened.add(fullname)
+
+    def _watch_events(self):
+        """ Handle events as they arrive until woken by __call__, so that new
+            directories are watched before the command uses them. """
+        while True:
+            ready = select.select([self._fd, self._wake_read], [], [])[0]
+            if self._fd in ready:
+                self._handle_events()
+            if self._wake_read in ready:
+                os.read(self._wake_read, 1)
+                break
+
+    def __call__(self, *args):
+        """ Run command and return its dependencies and outputs, using
+            inotify events to see which files it read and wrote. """
+        begin = self._builder.trace_begin()
+        self._update_watches()
+        # watch directories made since the last command, but drop the rest
+        self._handle_events()
+        self._reset()
+        self._builder.trace_end('watch', 'runner', begin)
+
+        begin = self._builder.trace_begin()
+        watcher = threading.Thread(target=self._watch_events)
+        watcher.start()
+        try:
+            shell(*args, **dict(silent=False))
+        finally:
+            os.write(self._wake_write, 'x')
+            watcher.join()
+        self._builder.trace_end('execute', 'command', begin)
+        begin = self._builder.trace_begin()
+        self._handle_events()
+
+        if self._overflow:
+            printerr('inotify queue overflowed, so the dependencies of %r '
+                     'are unknown' % args[0])
+            return None, None
+
+        # as for AtimesRunner, files modified are outputs even if ignored
+        outputs = set()
+        for name in self._created | self._modified:
+            if os.path.isfile(name) and \
+               (name not in self._created or not self.ignore(name)):
+                outputs.add(name)
+        deps = [name for name in self._opened
+                if name not in outputs and os.path.isfile(name)
+                   and not self.ignore(name)]
+        self._builder.trace_end('events', 'runner', begin)
+        return deps, list(outputs)
+
 class AlwaysRunner(Runner):
+    parallel_ok = True
+
     def __init__(self, builder):
-        pass
+        self._builder = builder
 
     def __call__(self, *args):
         """ Runner that always runs given command, used as a backup in case
             a system doesn't have strace or atimes. """
+        begin = self._builder.trace_begin()
         shell(*args, **dict(silent=False))
+        self._builder.trace_end('execute', 'command', begin)
         return None, None
 
 class SmartRunner(Runner):
@@ -617,21 +1600,37 @@ class SmartRunner(Runner):
         self._builder = builder
         self._runner = None
 
-    def __call__(self, *args):
-        """ Smart command runner that uses StraceRunner if it can,
-            otherwise AtimesRunner if available, otherwise AlwaysRunner.
-            When first called, it caches which runner it used for next time."""
-
+    def _select(self):
+        """ Pick a runner on first use and cache it for next time. InotifyRunner
+            is preferred, unless the builder runs several jobs at once and
+            StraceRunner (which can) is available. """
         if self._runner is None:
-            try:
-                self._runner = StraceRunner(self._builder)
-            except RunnerUnsupportedException:
+            begin = self._builder.trace_begin()
+            if self._builder.jobs > 1:
+                runners = [StraceRunner, InotifyRunner, AtimesRunner]
+            else:
+                runners = [InotifyRunner, StraceRunner, AtimesRunner]
+            for runner in runners:
                 try:
-                    self._runner = AtimesRunner(self._builder)
+                    self._runner = runner(self._builder)
+                    break
                 except RunnerUnsupportedException:
-                    self._runner = AlwaysRunner(self._builder)
+                    pass
+            else:
+                self._runner = AlwaysRunner(self._builder)
+            self._builder.trace_end('select runner', 'runner', begin,
+                                    runner=type(self._runner).__name__)
+        return self._runner
 
-        return self._runner(*args)
+    @property
+    def parallel_ok(self):
+        return self._select().parallel_ok
+
+    def __call__(self, *args):
+        """ Smart command runner that uses StraceRunner if it can,
+            otherwise AtimesRunner if available, otherwise AlwaysRunner.
+            When first called, it caches which runner it used for next time."""
+        return self._select()(*args)
 
 class Builder(object):
     """ The Builder.
@@ -652,13 +1651,14 @@ class Builder(object):
 
     def __init__(self, runner=None, dirs=None, dirdepth=100, ignoreprefix='.',
                  ignore=None, hasher=md5_hasher, depsname='.deps',
-                 quiet=False):
+                 quiet=False, jobs=1, hash_cache=True, trace=None,
+                 cache_dir=None, cache_size=1024**3):
         """ Initialise a Builder with the given options.
 
         "runner" specifies how programs should be run.  It is either a
             callable compatible with the Runner class, or a string selecting
             one of the standard runners ("atimes_runner", "strace_runner",
-            "always_runner", or "smart_runner").
+            "inotify_runner", "always_runner", or "smart_runner").
         "dirs" is a list of paths to look for dependencies (or outputs) in
             if using the strace or atimes runners.
         "dirdepth" is the depth to recurse into the paths in "dirs" (default
@@ -676,9 +1676,26 @@ class Builder(object):
         "hasher" is a function which returns a string which changes when
             the contents of its filename argument changes, or None on error.
             Default is md5_hasher, but can also be mtime_hasher.
-        "depsname" is the name of the JSON dependency file to load/save.
+        "depsname" is the name of the dependency journal file to load/save.
         "quiet" set to True tells the builder to not display the commands being
             executed (or other non-error output).
+        "jobs" is the maximum number of commands to run at once. Commands
+            only run in parallel if the runner supports it (StraceRunner and
+            AlwaysRunner do, AtimesRunner and InotifyRunner don't). Use the "group" and
+            "after" arguments of run() to order commands that depend on
+            each other.
+        "hash_cache" set to True (the default) keeps the hasher's results in
+            a HashCache stored in depsname + '.stat', so unchanged files
+            aren't read again. It has no effect with mtime_hasher.
+        "trace" is the name of a file to write a Chrome trace of the build
+            to (see Tracer), with spans for dependency checks, hashing, the
+            runner and each command (including its CPU time and maximum
+            RSS), or None for no trace.
+        "cache_dir" is the directory of an ArtifactCache to keep the
+            outputs of commands in, or None for no cache. Out of date
+            commands whose inputs match a cached run get their outputs from
+            the cache instead of running. It needs md5_hasher.
+        "cache_size" is the size in bytes the cache is trimmed to.
         """
         if runner is not None:
             self.set_runner(runner)
@@ -698,18 +1715,163 @@ class Builder(object):
         self.ignore = re.compile(ignore, re.VERBOSE)
         self.depsname = depsname
         self.hasher = hasher
+        self.hash_cache = hash_cache
+        self._hash_cache = None
+        self.trace = trace
+        self._tracer = None
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self._artifact_cache = None
+        self._hashes = {}                   # {normpath: hash} for this run
+        self._hashes_hasher = hasher
         self.quiet = quiet
         self.checking = False
+        self.jobs = jobs
+        self._lock = threading.Lock()       # serializes output and .deps
+        self._jobs_cond = threading.Condition()
+        self._queue = []                    # [(func, args, group, after)]
+        self._group_counts = {}             # {group: unfinished commands}
+        self._running = 0
+        self._errors = []                   # sys.exc_info() of failed jobs
+
+    def hash(self, filename):
+        """ Return the hasher's result for filename. The result is
+            remembered until a command changes the file (see forget_hashes),
+            so each file is hashed at most once per build otherwise. Files
+            are remembered by normalized path, so "./x" and "x" share one
+            entry. """
+        if self._hashes_hasher is not self.hasher:
+            self.forget_hashes()
+            self._hashes_hasher = self.hasher
+        hashes = self._hashes
+        key = os.path.normpath(filename)
+        try:
+            return hashes[key]
+        except KeyError:
+            begin = self.trace_begin()
+            hashed = hashes[key] = self._hash(filename)
+            self.trace_end('hash', 'hash', begin, file=filename)
+            return hashed
+
+    def trace_begin(self):
+        """ Return the start time of a span to give trace_end(), or None if
+            the build isn't being traced. """
+        if self.trace is None:
+            return None
+        tracer = self._tracer
+        if tracer is None or tracer.filename != self.trace:
+            self._lock.acquire()
+            try:
+                tracer = self._tracer
+                if tracer is None or tracer.filename != self.trace:
+                    tracer = Tracer(self.trace)
+                    atexit.register(tracer.write, os.path.abspath(self.trace))
+                    self._tracer = tracer
+            finally:
+                self._lock.release()
+        return time.time()
+
+    def trace_end(self, name, category, begin, **args):
+        """ Add a span from trace_begin()'s time until now to the trace,
+            with args to show with it. Does nothing if begin is None. """
+        if begin is not None:
+            self._tracer.add(name, category, begin, args=args)
+
+    def forget_hashes(self, filenames=None):
+        """ Forget the remembered hashes of the given files, or of all files
+            if filenames is None. """
+        if filenames is None:
+            self._hashes.clear()
+        else:
+            for filename in filenames:
+                self._hashes.pop(os.path.normpath(filename), None)
+
+    def _hash(self, filename):
+        """ Return the hasher's result for filename, using the HashCache
+            if enabled. """
+        if not self.hash_cache or self.hasher is mtime_hasher:
+            return self.hasher(filename)
+
+        cache = self._hash_cache
+        cachename = self.depsname + '.stat'
+        if cache is None or cache.hasher is not self.hasher or \
+           cache.filename != cachename:
+            self._lock.acquire()
+            try:
+                cache = self._hash_cache
+                if cache is None or cache.hasher is not self.hasher or \
+                   cache.filename != cachename:
+                    cache = HashCache(cachename, self.hasher)
+                    atexit.register(cache.write, os.path.abspath(cachename))
+                    self._hash_cache = cache
+            finally:
+                self._lock.release()
+        return cache(filename)
+
+    def artifact_cache(self):
+        """ Return the ArtifactCache for cache_dir, or None if there's no
+            cache (or the hasher doesn't give content hashes). """
+        if self.cache_dir is None or self.hasher is not md5_hasher:
+            return None
+        cache = self._artifact_cache
+        path = os.path.abspath(self.cache_dir)
+        if cache is None or cache.path != path:
+            self._lock.acquire()
+            try:
+                cache = self._artifact_cache
+                if cache is None or cache.path != path:
+                    cache = ArtifactCache(path, self.cache_size)
+                    atexit.register(cache.write)
+                    self._artifact_cache = cache
+            finally:
+                self._lock.release()
+        cache.max_size = self.cache_size
+        return cache
+
+    def _restore_cached(self, command):
+        """ Get the outputs of command from the artifact cache if it has them
+            for the current inputs, and record its dependencies as if it had
+            run. Return True if it did. """
+        cache = self.artifact_cache()
+        if cache is None:
+            return False
+        begin = self.trace_begin()
+        entry = cache.lookup(command, self.hash)
+        self.trace_end('cache lookup', 'cache', begin, command=command,
+                       hit=entry is not None)
+        if entry is None:
+            return False
+        self.echo_cached(command)
+        self.forget_hashes(entry['outputs'])
+        deps_dict = {}
+        for dep, hashed in entry['inputs'].items():
+            deps_dict[dep] = 'input-' + hashed
+        for output, hashed in entry['outputs'].items():
+            deps_dict[output] = 'output-' + hashed
+        self._lock.acquire()
+        try:
+            self.deps[command] = deps_dict
+        finally:
+            self._lock.release()
+        return True
 
     def echo(self, message):
         """ Print message, but only if builder is not in quiet mode. """
         if not self.quiet:
-            print message
+            self._lock.acquire()
+            try:
+                print message
+            finally:
+                self._lock.release()
 
     def echo_command(self, command):
         """ Show a command being executed. """
         self.echo(command)
 
+    def echo_cached(self, command):
+        """ Show a command whose outputs were restored from the cache. """
+        self.echo('%s (cached)' % command)
+
     def echo_delete(self, filename, error=None):
         """ Show a file being deleted. For subclassing Builder and overriding
             this function, the exception is passed in if an OSError occurs
@@ -717,12 +1879,26 @@ class Builder(object):
         if error is None:
             self.echo('deleting %s' % filename)
 
-    def run(self, *args):
+    def run(self, *args, **kwargs):
         """ Run command given in args as per shell(), but only if its
-            dependencies or outputs have changed or don't exist. """
+            dependencies or outputs have changed or don't exist.
+
+            If "jobs" is more than 1 the command is queued and may run in
+            parallel with others. Keyword arguments order queued commands:
+
+            "group" is a name for the group of commands this one belongs to.
+            "after" is a group name or list of group names. The command
+                won't start until every command queued so far in those groups
+                has finished.
+
+            Call after() to wait for queued commands. """
         arglist = args_to_list(args)
         if not arglist:
             raise TypeError('run() takes at least 1 argument (0 given)')
+        self._submit(self._run, (arglist,), **kwargs)
+
+    def _run(self, arglist):
+        """ Run the command in arglist if it's out of date. """
         # we want a command line string for the .deps file key and for display
         command = subprocess.list2cmdline(arglist)
         if not self.cmdline_outofdate(command):
@@ -733,21 +1909,144 @@ class Builder(object):
         if self.checking:
             return
 
+        if self._restore_cached(command):
+            return
+
         # use runner to run command and collect dependencies
         self.echo_command(command)
-        deps, outputs = self.runner(*arglist)
+        deps, outputs = self._call_runner(arglist)
         if deps is not None or outputs is not None:
-            deps_dict = {}
-            # hash the dependency inputs and outputs
-            for dep in deps:
-                hashed = self.hasher(dep)
-                if hashed is not None:
-                    deps_dict[dep] = "input-" + hashed
-            for output in outputs:
-                hashed = self.hasher(output)
-                if hashed is not None:
-                    deps_dict[output] = "output-" + hashed
+            self._record_deps(command, deps, outputs)
+
+    def _call_runner(self, arglist):
+        """ Run arglist with the runner and return (deps, outputs), first
+            forgetting the hashes of the files it wrote. If the runner can't
+            tell what it wrote, or fails, all hashes are forgotten. """
+        begin = self.trace_begin()
+        _child_rusage.last = None
+        try:
+            try:
+                deps, outputs = self.runner(*arglist)
+            except:
+                self.forget_hashes()
+                raise
+        finally:
+            if begin is not None:
+                args = {'command': subprocess.list2cmdline(arglist)}
+                rusage = _child_rusage.last
+                if rusage is not None:
+                    args.update(user_time=rusage.ru_utime,
+                                system_time=rusage.ru_stime,
+                                max_rss_kb=rusage.ru_maxrss)
+                self.trace_end(os.path.basename(arglist[0]), 'command',
+                               begin, **args)
+        if outputs is None:
+            self.forget_hashes()
+        else:
+            self.forget_hashes(outputs)
+        return deps, outputs
+
+    def _record_deps(self, command, deps, outputs):
+        """ Hash the given dependency inputs and outputs and save them as the
+            dependencies of command. """
+        begin = self.trace_begin()
+        deps_dict = {}
+        for dep in deps:
+            hashed = self.hash(dep)
+            if hashed is not None:
+                deps_dict[dep] = "input-" + hashed
+        for output in outputs:
+            hashed = self.hash(output)
+            if hashed is not None:
+                deps_dict[output] = "output-" + hashed
+        self._lock.acquire()
+        try:
             self.deps[command] = deps_dict
+        finally:
+            self._lock.release()
+        self.trace_end('record deps', 'deps', begin, command=command)
+
+        cache = self.artifact_cache()
+        if cache is not None:
+            begin = self.trace_begin()
+            cache.store(command, deps_dict)
+            self.trace_end('cache store', 'cache', begin, command=command)
+
+    def run_batch(self, batch_args, commands, **kwargs):
+        """ Run the out-of-date commands in "commands" (a list of argument
+            lists as per run()) together in a single process. They are
+            written one per line, quoted for a POSIX shell, to a temporary
+            file, and the command run is batch_args plus the name of that
+            file. This saves starting a process per command when a program
+            can do several jobs at once.
+
+            The dependencies and outputs of the batch process are divided
+            up between the commands: files named in a command's arguments
+            belong to that command only. Dependencies that none of the
+            commands name (like the program itself) belong to every command,
+            but outputs that none of them name (like a cache the program
+            keeps) belong to no command, so autoclean() leaves them alone.
+            Each command then gets its own .deps entry, just as if run() had
+            been called for it.
+
+            The "group" and "after" keyword arguments are as for run(). """
+        self._submit(self._run_batch, (batch_args, commands), **kwargs)
+
+    def _run_batch(self, batch_args, commands):
+        stale = []
+        for args in commands:
+            arglist = args_to_list([args])
+            if not arglist:
+                raise TypeError('run_batch() commands must not be empty')
+            command = subprocess.list2cmdline(arglist)
+            if self.cmdline_outofdate(command):
+                stale.append((command, arglist))
+        if not stale:
+            return
+
+        # if just checking up-to-date-ness, set flag and do nothing more
+        self.outofdate_flag = True
+        if self.checking:
+            return
+
+        stale = [(command, arglist) for command, arglist in stale
+                 if not self._restore_cached(command)]
+        if not stale:
+            return
+        for command, arglist in stale:
+            self.echo_command(command)
+        handle, jobsname = tempfile.mkstemp()
+        try:
+            try:
+                f = os.fdopen(handle, 'w')
+            except:
+                os.close(handle)
+                raise
+            try:
+                for command, arglist in stale:
+                    f.write(' '.join(pipes.quote(arg) for arg in arglist))
+                    f.write('\n')
+            finally:
+                f.close()
+            deps, outputs = self._call_runner(args_to_list([batch_args,
+                                                            jobsname]))
+        finally:
+            os.remove(jobsname)
+        if deps is None and outputs is None:
+            return
+
+        named = set()
+        for command, arglist in stale:
+            named.update(os.path.normpath(arg) for arg in arglist)
+        for command, arglist in stale:
+            own = set(os.path.normpath(arg) for arg in arglist)
+            def belongs(name):
+                name = os.path.normpath(name)
+                return name in own or name not in named
+            self._record_deps(command,
+                              [dep for dep in deps if belongs(dep)],
+                              [output for output in outputs
+                               if os.path.normpath(output) in own])
 
     def memoize(self, command):
         """ Run the given command, but only if its dependencies have changed --
@@ -764,11 +2063,93 @@ class Builder(object):
             args = args_to_list(command)
         try:
             self.run(args)
+            self.after()
             return 0
         except ExecutionError, exc:
             message, data, status = exc
             return status
 
+    def _submit(self, func, args, group=None, after=None):
+        """ Call func(*args) now, or queue it if running in parallel. """
+        if after is None:
+            after = []
+        elif isinstance(after, basestring):
+            after = [after]
+        if self.checking or self.jobs <= 1 or \
+                not getattr(self.runner, 'parallel_ok', False):
+            func(*args)
+            return
+
+        self.deps       # make sure deps are loaded before starting threads
+        self._jobs_cond.acquire()
+        try:
+            if self._errors:
+                return                  # a job failed, after() will raise
+            self._queue.append((func, args, group, after))
+            self._group_counts[group] = self._group_counts.get(group, 0) + 1
+            self._dispatch()
+        finally:
+            self._jobs_cond.release()
+
+    def _dispatch(self):
+        """ Start queued jobs whose "after" groups have finished, keeping at
+            most self.jobs running. Call with self._jobs_cond held. """
+        for job in self._queue[:]:
+            if self._running >= self.jobs:
+                break
+            func, args, group, after = job
+            if [g for g in after if g != group and self._group_counts.get(g)]:
+                continue
+            self._queue.remove(job)
+            self._running += 1
+            thread = threading.Thread(target=self._run_job, args=job)
+            thread.setDaemon(True)
+            thread.start()
+
+    def _run_job(self, func, args, group, after):
+        """ Thread body for a queued job. """
+        error = None
+        try:
+            func(*args)
+        except:
+            error = sys.exc_info()
+        self._jobs_cond.acquire()
+        try:
+            self._running -= 1
+            self._group_counts[group] -= 1
+            if error is not None:
+                # don't start anything else once a command has failed
+                self._errors.append(error)
+                for job in self._queue:
+                    self._group_counts[job[2]] -= 1
+                self._queue = []
+            self._dispatch()
+            self._jobs_cond.notifyAll()
+        finally:
+            self._jobs_cond.release()
+
+    def after(self, *groups):
+        """ Wait until all queued commands in the given groups have finished,
+            or all queued commands if no groups are given. If a command
+            failed, wait for the running ones and raise its exception. """
+        self._jobs_cond.acquire()
+        try:
+            while not self._errors:
+                if groups:
+                    if not [g for g in groups if self._group_counts.get(g)]:
+                        break
+                elif not self._running and not self._queue:
+                    break
+                self._jobs_cond.wait()
+            if self._errors:
+                while self._running:
+                    self._jobs_cond.wait()
+                error = self._errors[0]
+                self._errors = []
+                raise error[0], error[1], error[2]
+        finally:
+            self._jobs_cond.release()
+
     def outofdate(self, func):
         """ Return True if given build function is out of date. """
         self.checking = True
@@ -779,6 +2160,13 @@ class Builder(object):
 
     def cmdline_outofdate(self, command):
         """ Return True if given command line is out of date. """
+        begin = self.trace_begin()
+        try:
+            return self._cmdline_outofdate(command)
+        finally:
+            self.trace_end('outofdate', 'deps', begin, command=command)
+
+    def _cmdline_outofdate(self, command):
         if command in self.deps:
             # command has been run before, see if deps have changed
             for dep, oldhash in self.deps[command].items():
@@ -787,7 +2175,7 @@ class Builder(object):
                     "%s file corrupt, do a clean!" % self.depsname
                 oldhash = oldhash.split('-', 1)[1]
                 # make sure this dependency or output hasn't changed
-                newhash = self.hasher(dep)
+                newhash = self.hash(dep)
                 if newhash is None or newhash != oldhash:
                     break
             else:
@@ -806,7 +2194,13 @@ class Builder(object):
             outputs.extend(dep for dep, hashed in deps.items()
                            if hashed.startswith('output-'))
         outputs.append(self.depsname)
+        self._deps.discard()
         self._deps = None
+        self.forget_hashes()
+        if self._hash_cache is not None:
+            self._hash_cache.clear()
+        if os.path.exists(self.depsname + '.stat'):
+            outputs.append(self.depsname + '.stat')
         for output in outputs:
             try:
                 os.remove(output)
@@ -820,43 +2214,34 @@ class Builder(object):
         """ Lazy load .deps file so that instantiating a Builder is "safe". """
         if not hasattr(self, '_deps') or self._deps is None:
             self.read_deps()
-            atexit.register(self.write_deps, depsname=os.path.abspath(self.depsname))
+            atexit.register(self.write_deps)
         return self._deps
 
     def read_deps(self):
-        """ Read dependency JSON file into deps object. """
-        try:
-            f = open(self.depsname)
-            try:
-                self._deps = json.load(f)
-                # make sure the version is correct
-                if self._deps.get('.deps_version', 0) != deps_version:
-                    printerr('Bad %s dependency file version! Rebuilding.'
-                             % self.depsname)
-                    self._deps = {}
-                self._deps.pop('.deps_version', None)
-            finally:
-                f.close()
-        except IOError:
-            self._deps = {}
+        """ Open the dependency journal as the deps object. """
+        self._deps = DepsJournal(self.depsname)
+        # make sure the version is correct
+        if self._deps.bad_version:
+            printerr('Bad %s dependency file version! Rebuilding.'
+                     % self.depsname)
 
     def write_deps(self, depsname=None):
-        """ Write out deps object into JSON dependency file. """
-        if self._deps is None:
+        """ Finish writing the dependency journal, compacting it if it has
+            grown too much, or write a compacted copy to depsname. Each
+            command's dependencies are saved as soon as it finishes, so this
+            isn't needed to keep them. """
+        if not hasattr(self, '_deps') or self._deps is None:
             return                      # we've cleaned so nothing to save
-        self.deps['.deps_version'] = deps_version
-        if depsname is None:
-            depsname = self.depsname
-        f = open(depsname, 'w')
-        try:
-            json.dump(self.deps, f, indent=4, sort_keys=True)
-        finally:
-            f.close()
-            self._deps.pop('.deps_version', None)
+        if depsname is None or \
+           os.path.abspath(depsname) == self._deps.filename:
+            self._deps.close()
+        else:
+            self._deps.write(depsname)
 
     _runner_map = {
         'atimes_runner' : AtimesRunner,
         'strace_runner' : StraceRunner,
+        'inotify_runner' : InotifyRunner,
         'always_runner' : AlwaysRunner,
         'smart_runner' : SmartRunner,
         }
@@ -865,7 +2250,7 @@ class Builder(object):
         """Set the runner for this builder.  "runner" is either a Runner
            subclass (e.g. SmartRunner), or a string selecting one of the
            standard runners ("atimes_runner", "strace_runner",
-           "always_runner", or "smart_runner")."""
+           "inotify_runner", "always_runner", or "smart_runner")."""
         try:
             self.runner = self._runner_map[runner](self)
         except KeyError:
@@ -911,10 +2296,19 @@ def setup(builder=None, default=None, **kwargs):
         default_command = default
     default_builder.__init__(**kwargs)
 
-def run(*args):
+def run(*args, **kwargs):
     """ Run the given command, but only if its dependencies have changed. Uses
         the default Builder. """
-    default_builder.run(*args)
+    default_builder.run(*args, **kwargs)
+
+def run_batch(batch_args, commands, **kwargs):
+    """ Run the given commands together in one process, but only those whose
+        dependencies have changed. Uses the default Builder. """
+    default_builder.run_batch(batch_args, commands, **kwargs)
+
+def after(*groups):
+    """ Wait for queued commands of the default Builder to finish. """
+    default_builder.after(*groups)
 
 def autoclean():
     """ Automatically delete all outputs of the default build. """
@@ -944,6 +2338,20 @@ def parse_options(usage, extra_options=None):
                       help="don't echo commands, only print errors")
     parser.add_option('-k', '--keep', action='store_true',
                       help='keep temporary strace output files')
+    parser.add_option('-j', '--jobs', type='int',
+                      help='run up to JOBS commands at once')
+    parser.add_option('--trace', metavar='FILE',
+                      help='write a Chrome trace of the build to FILE')
+    parser.add_option('--cache', metavar='DIR',
+                      default=os.environ.get('FABRICATE_CACHE_DIR'),
+                      help='restore outputs from the shared cache in DIR '
+                           'instead of rerunning commands, and save new ones '
+                           'there (default: $FABRICATE_CACHE_DIR)')
+    parser.add_option('--cache-size', metavar='SIZE', default='1G',
+                      help='trim the cache to SIZE bytes, which may end '
+                           'in K, M or G (default: 1G)')
+    parser.add_option('--cache-stats', action='store_true',
+                      help='print the cache statistics after the build')
     if extra_options:
         # add any user-specified options passed in via main()
         for option in extra_options:
@@ -958,8 +2366,49 @@ def parse_options(usage, extra_options=None):
         default_builder.autoclean()
     if options.keep:
         StraceRunner.keep_temps = options.keep
+    if options.jobs:
+        default_builder.jobs = options.jobs
+    if options.trace:
+        default_builder.trace = options.trace
+    if options.cache:
+        default_builder.cache_dir = options.cache
+    try:
+        default_builder.cache_size = parse_size(options.cache_size)
+    except ValueError:
+        parser.error('invalid cache size: %r' % options.cache_size)
     return parser, options, args
 
+def parse_size(text):
+    """ Return the number of bytes in a size like '500', '64K' or '1.5G'. """
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3}
+    text = text.strip().upper()
+    scale = 1
+    if text[-1:] in units:
+        scale = units[text[-1]]
+        text = text[:-1]
+    return int(float(text) * scale)
+
+def print_cache_stats(builder=None):
+    """ Print the artifact cache's statistics, including this build's. """
+    if builder is None:
+        builder = default_builder
+    cache = builder.artifact_cache()
+    if cache is None:
+        print 'No artifact cache (use --cache DIR or $FABRICATE_CACHE_DIR)'
+        return
+    cache.write()
+    stats = cache.stats()
+    lookups = stats['hits'] + stats['misses']
+    print 'cache directory  %s' % cache.path
+    print 'hits             %d' % stats['hits']
+    print 'misses           %d' % stats['misses']
+    if lookups:
+        print 'hit rate         %.1f%%' % (100.0 * stats['hits'] / lookups)
+    print 'stores           %d' % stats['stores']
+    print 'evictions        %d' % stats['evictions']
+    print 'size             %.1f of %.1f MB' % (stats['size'] / 1024.0**2,
+                                               cache.max_size / 1024.0**2)
+
 def main(globals_dict=None, build_dir=None, extra_options=None):
     """ Run the default function or the function(s) named in the command line
         arguments. Call this at the end of your build script. If one of the
@@ -1003,11 +2452,14 @@ def main(globals_dict=None, build_dir=None, extra_options=None):
             name = action.split('(')[0].split('.')[0]
             if name in globals_dict:
                 this_status = eval(action, globals_dict)
+                default_builder.after()
                 if this_status:
                     status = int(this_status)
             else:
                 printerr('%r command not defined!' % action)
                 sys.exit(1)
+        if options.cache_stats:
+            print_cache_stats()
     except ExecutionError, exc:
         message, data, status = exc
         printerr('fabricate: ' + message)
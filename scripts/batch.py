@@ -0,0 +1,55 @@
+# Copyright 2010 Kevin Goodsell
+#
+# This file is part of vim-xterm-colors.
+#
+# vim-xterm-colors is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License Version 2
+# as published by the Free Software Foundation.
+#
+# vim-xterm-colors is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with vim-xterm-colors.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import multiprocessing
+import shlex
+import sys
+
+def read_batch(filename):
+    '''
+    Return the argument lists from a batch file, without the program names.
+    The command lines are quoted as for a POSIX shell. A filename of '-'
+    reads stdin.
+    '''
+    if filename == '-':
+        f = sys.stdin
+    else:
+        f = open(filename)
+
+    commands = []
+    for line in f:
+        # Skip the program name
+        args = shlex.split(line)[1:]
+        if args:
+            commands.append(args)
+
+    return commands
+
+def pool_map(func, items, jobs=None):
+    '''
+    Return map(func, items), computed by a pool of jobs processes (one per
+    CPU by default) when there's more than one item. With jobs == 1 it all
+    happens in this process.
+    '''
+    if len(items) > 1 and jobs != 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.terminate()
+    else:
+        return map(func, items)
@@ -17,62 +17,106 @@
 
 from __future__ import division
 
+import hashlib
+import heapq
+import itertools
+import math
+import mmap
+import os
 import re
+import struct
 import subprocess
 import sys
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class Color(object):
-    def __init__(self, red, green, blue):
-        self.red = red
-        self.green = green
-        self.blue = blue
+    '''
+    An RGB color. Colors are immutable and interned: there is one instance
+    for each value, so making a color that already exists returns it, and
+    from_string remembers what each string gave. The value is also kept
+    packed into one 24-bit integer, rgb, which is the hash.
+
+    Nothing is ever removed from _interned or _strings, so they grow for
+    the life of the process: by at most one entry per distinct color, and
+    one per distinct string given to from_string.
+    '''
+    __slots__ = ('red', 'green', 'blue', 'rgb')
+
+    _interned = {} # {rgb : Color()}
+
+    def __new__(cls, red, green, blue):
+        if not (0 <= red <= 255 and 0 <= green <= 255 and 0 <= blue <= 255):
+            raise ValueError('Bad color value: (%r, %r, %r)'
+                             % (red, green, blue))
+        rgb = (red << 16) | (green << 8) | blue
+        self = cls._interned.get(rgb)
+        if self is not None and self.__class__ is cls:
+            return self
+
+        self = object.__new__(cls)
+        setattr = object.__setattr__
+        setattr(self, 'red', red)
+        setattr(self, 'green', green)
+        setattr(self, 'blue', blue)
+        setattr(self, 'rgb', rgb)
+        if cls is Color:
+            cls._interned[rgb] = self
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s objects are immutable'
+                             % self.__class__.__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%s objects are immutable'
+                             % self.__class__.__name__)
+
+    def __reduce__(self):
+        return (self.__class__, (self.red, self.green, self.blue))
 
     _hex_matcher = re.compile('''\#?(?P<r>[0-9A-Fa-f]{2})
                                     (?P<g>[0-9A-Fa-f]{2})
                                     (?P<b>[0-9A-Fa-f]{2})''', re.VERBOSE)
 
     _color_names = None
-    _nearest_cache = {} # {Color(), cterm_color_num}
-    _xterm_overrides = {}
+    _strings = {} # {string : Color()}, for from_string
+    _xterm_overrides = {} # {Color() : color number}, for the target palette
+    _metric = None # the Metric (and so the target Palette) for nearest_xterm
+
+    color_names_path = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'color-names.tbl')
 
     @classmethod
     def from_string(cls, s):
-        if cls._color_names is None:
-            cls._color_names = _get_color_names()
+        c = cls._strings.get(s)
+        if c is not None:
+            return c
 
-        if s.lower() in cls._color_names:
-            return cls._color_names[s.lower()]
+        if cls._color_names is None:
+            cls._color_names = NameTable.load(cls.color_names_path)
 
-        m = cls._hex_matcher.match(s)
-        if m is None:
-            raise ValueError('Bad color string: %s' % s)
-        r = int(m.group('r'), 16)
-        g = int(m.group('g'), 16)
-        b = int(m.group('b'), 16)
+        c = cls._color_names.get(s.lower())
+        if c is None:
+            m = cls._hex_matcher.match(s)
+            if m is None:
+                raise ValueError('Bad color string: %s' % s)
+            c = cls(int(m.group('r'), 16), int(m.group('g'), 16),
+                    int(m.group('b'), 16))
 
-        return cls(r, g, b)
+        cls._strings[s] = c
+        return c
 
     @classmethod
-    def from_xterm_color(cls, color_num):
-        if color_num < 16 or color_num > 255:
-            raise ValueError('Bad color number: %d' % color_num)
-
-        if color_num < 232: # RGB
-            adjusted = color_num - 16
-            levels = [0x00, 0x5f, 0x87, 0xaf, 0xd7, 0xff]
-
-            blue = adjusted % 6
-            adjusted //= 6
-            green = adjusted % 6
-            red = adjusted // 6
-
-            return cls(levels[red], levels[green], levels[blue])
-
-        else: # Grays
-            index = color_num - 232
-            level = 8 + 10 * index
-
-            return cls(level, level, level)
+    def from_xterm_color(cls, color_num, palette=None):
+        '''
+        Return the Color for color_num in palette (a Palette or a name for
+        get_palette, xterm-256 by default).
+        '''
+        return get_palette(palette).color(color_num)
 
     @classmethod
     def add_xterm_overrides(cls, overrides):
@@ -83,72 +127,383 @@ class Color(object):
             c = cls.from_string(gui)
             cls._xterm_overrides[c] = int(xterm)
 
+    @classmethod
+    def add_nearest_cache(cls, colors, use_numpy=None, palette=None):
+        '''
+        Find the nearest xterm colors for all of colors in one batch and
+        cache them for nearest_xterm. palette is as for nearest_xterm.
+        '''
+        metric = cls._target_metric(palette)
+        overrides = {}
+        if metric is cls._metric:
+            overrides = cls._xterm_overrides
+        colors = [c for c in set(colors)
+                  if c not in overrides and c not in metric.cache]
+        xterms = metric.nearest_many(colors, use_numpy)
+        for (c, xterm) in zip(colors, xterms):
+            metric.cache[c] = xterm
+
+    @classmethod
+    def set_metric(cls, name):
+        '''
+        Use the metric called name (see metric_names) to find nearest colors.
+        '''
+        palette = None
+        if cls._metric is not None:
+            palette = cls._metric.palette
+        cls._metric = get_metric(name, palette)
+
+    @classmethod
+    def set_palette(cls, palette):
+        '''
+        Choose nearest colors from palette (a Palette or a name for
+        get_palette) from now on. Overrides are numbers in this palette.
+        '''
+        cls._metric = get_metric(cls._metric.name, palette)
+
+    @classmethod
+    def palette(cls):
+        '''
+        Return the target Palette.
+        '''
+        return cls._metric.palette
+
+    @classmethod
+    def _target_metric(cls, palette):
+        if palette is None:
+            return cls._metric
+        return get_metric(cls._metric.name, palette)
+
+    @classmethod
+    def clear_xterm_overrides(cls):
+        cls._xterm_overrides = {}
+
     def as_hex(self):
         return '%02X%02X%02X' % (self.red, self.green, self.blue)
 
-    def nearest_xterm(self, debug=False):
+    def nearest_xterm(self, debug=False, palette=None):
+        '''
+        Return the number of the nearest color in palette (a Palette or a
+        name for get_palette), by default the one set with set_palette.
+        Overrides only apply to that one.
+        '''
+        metric = Color._target_metric(palette)
+
         # Check overrides
-        if self in self._xterm_overrides:
+        if metric is Color._metric and self in self._xterm_overrides:
             return self._xterm_overrides[self]
 
         # Check cache
-        if self in self._nearest_cache:
-            return self._nearest_cache[self]
+        if self in metric.cache:
+            return metric.cache[self]
 
         if debug:
-            nearest = self._nearest_xterms(5)
+            nearest = metric.nearest_xterms(self, 5)
             text = ', '.join(str(x) for (dist, x) in nearest)
             print >> sys.stderr, '%r possible matches: %s' % (self, text)
-        else:
-            nearest = self._nearest_xterms(1)
 
-        (dist, xterm) = nearest[0]
+        xterm = metric.nearest(self)
 
         # Add to cache
-        self._nearest_cache[self] = xterm
+        metric.cache[self] = xterm
         return xterm
 
     def _nearest_xterms(self, count, max_grays=1):
-        g_distances = [(color_distance(self, x), x)
-                       for x in self._xterm_grays]
-        c_distances = [(color_distance(self, x), x)
-                       for x in self._xterm_colors]
+        # Both searches produce colors in order of distance, so only about
+        # count colors are ever measured.
         if count == 1:
-            result = [min(g_distances + c_distances)]
-        else:
-            g_distances.sort()
-            dists = c_distances + g_distances[:max_grays]
-            dists.sort()
-            result = dists[:count]
+            max_grays = 1
+        grays = itertools.islice(self._nearest_grays(), max_grays)
+        nearest = heapq.merge(self._nearest_cube_colors(), grays)
+        result = itertools.islice(nearest, count)
+
+        return [(dist, xterm) for (dist, rank, xterm) in result]
+
+    def _nearest_cube_colors(self):
+        '''
+        Generate (distance, rank, xterm) for the non-gray colors of the
+        xterm-256 color cube, nearest first.
+        '''
+        # The cube is a 6x6x6 grid and color_distance is a sum of one term
+        # per channel, where only the blue term depends on the red level. So
+        # for each red level this is a search for the smallest sums from two
+        # sorted lists, done with a heap. Channel ties are sorted by level,
+        # which keeps the ties between colors in _xterm_rank order.
+        greens = sorted((4 * (self.green - level) ** 2, i)
+                        for (i, level) in enumerate(_cube_levels))
+        reds = []
+        heap = []
+        for (i, level) in enumerate(_cube_levels):
+            rmean = (self.red + level) // 2
+            red_term = ((512 + rmean) * (self.red - level) ** 2) >> 8
+            blues = sorted((((767 - rmean) * (self.blue - b) ** 2) >> 8, j)
+                           for (j, b) in enumerate(_cube_levels))
+            reds.append((red_term, blues))
+            heap.append(self._cube_entry(reds, greens, i, 0, 0))
+        heapq.heapify(heap)
+
+        seen = set((i, 0, 0) for i in range(len(reds)))
+        while heap:
+            entry = heapq.heappop(heap)
+            (dist, rank, xterm, i, g, b) = entry
+            if xterm not in _xterm_gray_indices:
+                yield (dist, rank, xterm)
+
+            for (g2, b2) in ((g + 1, b), (g, b + 1)):
+                if g2 < len(_cube_levels) and b2 < len(_cube_levels) and \
+                   (i, g2, b2) not in seen:
+                    seen.add((i, g2, b2))
+                    heapq.heappush(heap,
+                                   self._cube_entry(reds, greens, i, g2, b2))
+
+    @staticmethod
+    def _cube_entry(reds, greens, i, g, b):
+        (red_term, blues) = reds[i]
+        (green_term, green) = greens[g]
+        (blue_term, blue) = blues[b]
+        xterm = 16 + 36 * i + 6 * green + blue
+        return (red_term + green_term + blue_term, _xterm_rank[xterm], xterm,
+                i, g, b)
+
+    def _nearest_grays(self):
+        '''
+        Generate (distance, rank, xterm) for the xterm-256 grays, nearest
+        first.
+        '''
+        # Ordered by level, the distances to the grays fall to a single
+        # minimum and then rise again (this holds for every 24-bit color).
+        # Find the minimum by binary search, then walk outwards.
+        keys = {}
+        def key(i):
+            if i not in keys:
+                (level, xterm, c) = _gray_levels[i]
+                keys[i] = (color_distance(self, c), _xterm_rank[xterm], xterm)
+            return keys[i]
 
-        return [(dist, self._color_map[c]) for (dist, c) in result]
+        lo = 0
+        hi = len(_gray_levels) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key(mid) < key(mid + 1):
+                hi = mid
+            else:
+                lo = mid + 1
 
-    def _tuple(self):
-        return (self.__class__, self.red, self.green, self.blue)
+        yield key(lo)
+        left = lo - 1
+        right = lo + 1
+        while left >= 0 or right < len(_gray_levels):
+            if right >= len(_gray_levels) or \
+               (left >= 0 and key(left) < key(right)):
+                yield key(left)
+                left -= 1
+            else:
+                yield key(right)
+                right += 1
 
     def __hash__(self):
-        return hash(self._tuple())
+        return self.rgb
 
     def __eq__(self, other):
-        return self._tuple() == other._tuple()
+        return self is other or (self.__class__ is other.__class__ and
+                                 self.rgb == other.rgb)
+
+    def __ne__(self, other):
+        return not self == other
 
     def __repr__(self):
         return '%s(0x%02x, 0x%02x, 0x%02x)' % (self.__class__.__name__,
                                                self.red, self.green, self.blue)
 
-# grays are distributed every (36+6+1) in the colorcube (16 to 231), and make
-# up the last elements, 232 to 255.
-_xterm_gray_indices = set(range(16, 232, 36+6+1) + range(232, 256))
-Color._color_map = {}
-Color._xterm_grays = []
-Color._xterm_colors = []
-for i in range(16, 256):
-    c = Color.from_xterm_color(i)
-    Color._color_map[c] = i
-    if i in _xterm_gray_indices:
-        Color._xterm_grays.append(c)
-    else:
-        Color._xterm_colors.append(c)
+class Palette(object):
+    '''
+    The colors a terminal has for cterm colors: the Color for each color
+    number, in tie-breaking order (of two colors at the same distance, the
+    first wins). Colors with equal red, green and blue are grays.
+
+    Each palette has its own NearestTable, kept in a file named for the
+    palette. Built-in palettes keep theirs in table_dir, next to this file.
+    Palettes loaded from a file name theirs for their colors and keep them
+    in cache_dir, so edited palette files don't leave tables in the source
+    tree. The table records the colors it was made for, so it's rebuilt if
+    they change.
+    '''
+    table_dir = os.path.dirname(os.path.abspath(__file__))
+    cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                             os.path.join(os.path.expanduser('~'), '.cache'),
+                             'vim-xterm-colors')
+
+    _line_matcher = re.compile(r'''
+        \s*(?:[\w.*]*color)?(?P<number>[0-9]+)
+        (?:\s*:\s*|\s+)(?P<color>\S+)\s*$
+    ''', re.VERBOSE)
+
+    def __init__(self, name, entries, table_name=None):
+        self.name = name
+        self.entries = list(entries) # [(number, Color())]
+        if not self.entries:
+            raise ValueError('Palette %s has no colors' % name)
+
+        self._by_number = {}
+        for (number, c) in self.entries:
+            if number < 0 or number > 255 or number in self._by_number:
+                raise ValueError('Bad color number in palette %s: %d'
+                                 % (name, number))
+            self._by_number[number] = c
+
+        # [(number, red, green, blue)] in tie-breaking order
+        self.ranked = [(number, c.red, c.green, c.blue)
+                       for (number, c) in self.entries]
+        self.grays = set(number for (number, r, g, b) in self.ranked
+                         if r == g == b)
+        self.digest = hashlib.md5(repr(self.ranked)).digest()
+
+        if table_name is None:
+            self.table_path = os.path.join(self.cache_dir, 'nearest-%s.tbl'
+                                           % self.digest.encode('hex'))
+        else:
+            self.table_path = os.path.join(self.table_dir,
+                                           'nearest-%s.tbl' % table_name)
+        self._table = None
+
+    @classmethod
+    def load(cls, filename):
+        '''
+        Read a palette from a file with a color number and a color (a name
+        or hex value, see Color.from_string) on each line. X resources such
+        as '*color4: #0000ee' work too, so the palette can be taken from an
+        .Xresources file; other resources are skipped, as are blank lines
+        and lines starting with '#' or '!'. A number given twice gets the
+        last color. Ties go to the lower number.
+        '''
+        f = open(filename)
+        try:
+            lines = f.readlines()
+        finally:
+            f.close()
+
+        colors = {}
+        for (i, line) in enumerate(lines):
+            if not line.strip() or line.lstrip()[0] in '#!':
+                continue
+            m = cls._line_matcher.match(line)
+            if m is None:
+                if ':' in line:
+                    continue
+                raise ValueError('%s:%d: bad palette line: %s'
+                                 % (filename, i + 1, line.strip()))
+            try:
+                c = Color.from_string(m.group('color'))
+            except ValueError, e:
+                raise ValueError('%s:%d: %s' % (filename, i + 1, e))
+            colors[int(m.group('number'))] = c
+
+        return cls(filename, sorted(colors.items()))
+
+    def color(self, number):
+        c = self._by_number.get(number)
+        if c is None:
+            raise ValueError('Bad color number: %d' % number)
+        return c
+
+    def nearest_table(self):
+        if self._table is None:
+            directory = os.path.dirname(self.table_path)
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    pass # the table is kept in memory instead
+            self._table = NearestTable.load(self.table_path, self)
+        return self._table
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.name)
+
+def _xterm_palette(name, levels, gray_levels):
+    '''
+    Return the Palette for an xterm with a color cube of the given levels,
+    followed by a gray ramp. Colors 0-15 are left out, since their values
+    are often changed. When two colors are at the same distance, the gray
+    ramp wins over the color cube, then the lower color number wins.
+    '''
+    cube = [(16 + i, Color(r, g, b)) for (i, (r, g, b))
+            in enumerate(itertools.product(levels, repeat=3))]
+    first_gray = 16 + len(cube)
+    ramp = [(first_gray + i, Color(level, level, level))
+            for (i, level) in enumerate(gray_levels)]
+    return Palette(name, ramp + cube, name)
+
+_palettes = {} # {name : Palette()}, for the built-in palettes
+_palette_files = {} # {absolute file name : Palette()}
+
+default_palette = 'xterm-256'
+
+def register_palette(palette):
+    '''
+    Make palette available by its name.
+    '''
+    _palettes[palette.name] = palette
+    return palette
+
+def palette_names():
+    return sorted(_palettes)
+
+def get_palette(name=None):
+    '''
+    Return the shared Palette called name, or read from the file name. With
+    no name, return the default palette. A Palette is returned as it is.
+    '''
+    if name is None:
+        name = default_palette
+    if isinstance(name, Palette):
+        return name
+
+    palette = _palettes.get(name)
+    if palette is None:
+        filename = os.path.abspath(name)
+        palette = _palette_files.get(filename)
+        if palette is None:
+            if not os.path.isfile(filename):
+                raise ValueError('Unknown palette: %s' % name)
+            palette = _palette_files[filename] = Palette.load(name)
+    return palette
+
+_cube_levels = [0x00, 0x5f, 0x87, 0xaf, 0xd7, 0xff]
+
+_xterm_256 = register_palette(_xterm_palette(
+    'xterm-256', _cube_levels, [8 + 10 * i for i in range(24)]))
+
+# rxvt and xterm built for 88 colors (see xterm's 88colres.h)
+register_palette(_xterm_palette(
+    'xterm-88', [0x00, 0x8b, 0xcd, 0xff],
+    [0x2e, 0x5c, 0x73, 0x8b, 0xa2, 0xb9, 0xd0, 0xe7]))
+
+# The 16 ANSI colors with xterm's default values. Terminals differ, so a
+# palette file is better when the real values are known.
+register_palette(Palette('xterm-16', [
+    (0, Color(0x00, 0x00, 0x00)), (1, Color(0xcd, 0x00, 0x00)),
+    (2, Color(0x00, 0xcd, 0x00)), (3, Color(0xcd, 0xcd, 0x00)),
+    (4, Color(0x00, 0x00, 0xee)), (5, Color(0xcd, 0x00, 0xcd)),
+    (6, Color(0x00, 0xcd, 0xcd)), (7, Color(0xe5, 0xe5, 0xe5)),
+    (8, Color(0x7f, 0x7f, 0x7f)), (9, Color(0xff, 0x00, 0x00)),
+    (10, Color(0x00, 0xff, 0x00)), (11, Color(0xff, 0xff, 0x00)),
+    (12, Color(0x5c, 0x5c, 0xff)), (13, Color(0xff, 0x00, 0xff)),
+    (14, Color(0x00, 0xff, 0xff)), (15, Color(0xff, 0xff, 0xff)),
+], 'xterm-16'))
+
+# The xterm-256 search in Color._nearest_xterms relies on the shape of its
+# color cube and gray ramp. These describe it.
+_xterm_gray_indices = _xterm_256.grays
+_xterm_rank = dict((xterm, rank) for (rank, (xterm, c))
+                   in enumerate(_xterm_256.entries))
+
+# [(level, xterm, Color())] for all grays, sorted by level
+_gray_levels = sorted((c.red, xterm, c) for (xterm, c) in _xterm_256.entries
+                      if xterm in _xterm_gray_indices)
 
 def color_distance(color1, color2):
     # http://www.compuphase.com/cmetric.htm
@@ -166,6 +521,761 @@ def color_distance(color1, color2):
         (((767 - rmean) * b*b) >> 8)
     )
 
+class Metric(object):
+    '''
+    A way of measuring how different two colors look, for choosing the
+    nearest color in a Palette. A metric converts RGB colors to coordinates
+    in its own space (convert) and measures the distance between coordinates
+    (distance). There is one instance for each palette; the palette is
+    converted once, when it's first needed, and the nearest colors found are
+    kept in cache.
+
+    A metric can also define array_distance, which does the same as
+    distance for NumPy arrays whose last axis holds the coordinates. Then
+    nearest_many measures whole batches at once.
+
+    squared is True if distance gives the square of the real distance, which
+    is cheaper and compares the same.
+    '''
+    name = None
+    description = None
+    array_distance = None
+    squared = True
+
+    def __init__(self, palette):
+        self.palette = palette
+        self.cache = {} # {Color() : xterm}
+        self._coordinates = None
+        self._coordinates_array = None
+
+    def convert(self, red, green, blue):
+        raise NotImplementedError
+
+    def distance(self, coords1, coords2):
+        raise NotImplementedError
+
+    def coordinates(self):
+        '''
+        Return [(xterm, coords)] for the palette colors, in tie-breaking
+        order.
+        '''
+        if self._coordinates is None:
+            self._coordinates = [(xterm, self.convert(r, g, b))
+                                 for (xterm, r, g, b) in self.palette.ranked]
+        return self._coordinates
+
+    def nearest(self, c):
+        '''
+        Return the xterm color nearest to the Color c. Ties go to the first
+        in tie-breaking order.
+        '''
+        coords = self.convert(c.red, c.green, c.blue)
+        distance = self.distance
+        best = None
+        for (xterm, other) in self.coordinates():
+            dist = distance(coords, other)
+            if best is None or dist < best[0]:
+                best = (dist, xterm)
+        return best[1]
+
+    def nearest_many(self, colors, use_numpy=None):
+        '''
+        Return a list of the nearest xterm color to each Color in colors, the
+        same as nearest() gives. The distances are measured as one NumPy
+        array operation when NumPy is available, unless use_numpy is False.
+        '''
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        if not use_numpy or self.array_distance is None or not colors:
+            return [self.nearest(c) for c in colors]
+
+        if self._coordinates_array is None:
+            self._coordinates_array = numpy.array(
+                [coords for (xterm, coords) in self.coordinates()])
+        coords = numpy.array([self.convert(c.red, c.green, c.blue)
+                              for c in colors])
+        # One row per color, one column per palette entry, columns in
+        # tie-breaking order.
+        dists = self.array_distance(
+            coords[:, numpy.newaxis, :],
+            self._coordinates_array[numpy.newaxis, :, :])
+        # argmin returns the first minimum, which is the tie-break winner.
+        xterms = [xterm for (xterm, coords) in self.coordinates()]
+        return [xterms[i] for i in dists.argmin(axis=1).tolist()]
+
+    def nearest_xterms(self, c, count, max_grays=1):
+        '''
+        Return [(distance, xterm)] for the count palette colors nearest to
+        the Color c, with no more than max_grays grays, as for
+        Color._nearest_xterms.
+        '''
+        if count == 1:
+            max_grays = 1
+        coords = self.convert(c.red, c.green, c.blue)
+        dists = sorted((self.distance(coords, other), rank, xterm)
+                       for (rank, (xterm, other))
+                       in enumerate(self.coordinates()))
+        result = []
+        grays = 0
+        for (dist, rank, xterm) in dists:
+            if xterm in self.palette.grays:
+                if grays >= max_grays:
+                    continue
+                grays += 1
+            result.append((dist, xterm))
+            if len(result) == count:
+                break
+        return result
+
+_metric_classes = {} # {name : Metric subclass}
+_metrics = {} # {(name, Palette()) : Metric()}
+
+default_metric = 'weighted-rgb'
+
+def register_metric(cls):
+    '''
+    Make the Metric subclass cls available by its name.
+    '''
+    _metric_classes[cls.name] = cls
+    return cls
+
+def metric_names():
+    return sorted(_metric_classes)
+
+def get_metric(name, palette=None):
+    '''
+    Return the shared instance of the metric called name for palette (a
+    Palette or a name for get_palette).
+    '''
+    palette = get_palette(palette)
+    metric = _metrics.get((name, palette))
+    if metric is None:
+        if name not in _metric_classes:
+            raise ValueError('Unknown color metric: %s' % name)
+        metric = _metrics[(name, palette)] = _metric_classes[name](palette)
+    return metric
+
+@register_metric
+class WeightedRGBMetric(Metric):
+    '''
+    color_distance, a weighted distance in sRGB. This is the default, and the
+    only metric with a precomputed NearestTable for each palette.
+    '''
+    name = 'weighted-rgb'
+    description = 'weighted sRGB distance (compuphase, the default)'
+
+    def convert(self, red, green, blue):
+        return (red, green, blue)
+
+    def distance(self, rgb1, rgb2):
+        (r1, g1, b1) = rgb1
+        (r2, g2, b2) = rgb2
+        rmean = (r1 + r2) // 2
+        r = r1 - r2
+        g = g1 - g2
+        b = b1 - b2
+        return (
+            (((512 + rmean) * r*r) >> 8) +
+            4 * g*g +
+            (((767 - rmean) * b*b) >> 8)
+        )
+
+    def nearest(self, c):
+        return self.palette.nearest_table().lookup(c.red, c.green, c.blue)
+
+    def nearest_many(self, colors, use_numpy=None):
+        (xterms, dists) = nearest_xterm_many(colors, use_numpy=use_numpy,
+                                             palette=self.palette)
+        return xterms
+
+    def nearest_xterms(self, c, count, max_grays=1):
+        if self.palette is _xterm_256:
+            return c._nearest_xterms(count, max_grays)
+        return Metric.nearest_xterms(self, c, count, max_grays)
+
+@register_metric
+class LinearRGBMetric(Metric):
+    '''
+    Squared distance between linear (gamma-expanded) RGB values.
+    '''
+    name = 'linear-rgb'
+    description = 'distance in linear (gamma-corrected) RGB'
+
+    def convert(self, red, green, blue):
+        return (_linear_levels[red], _linear_levels[green],
+                _linear_levels[blue])
+
+    def distance(self, rgb1, rgb2):
+        (r1, g1, b1) = rgb1
+        (r2, g2, b2) = rgb2
+        return (r1 - r2) ** 2 + (g1 - g2) ** 2 + (b1 - b2) ** 2
+
+    def array_distance(self, rgb1, rgb2):
+        return ((rgb1 - rgb2) ** 2).sum(axis=-1)
+
+@register_metric
+class CIE76Metric(Metric):
+    '''
+    CIE 1976 Delta E: distance in CIELAB (squared).
+    '''
+    name = 'cie76'
+    description = 'CIELAB Delta E 1976'
+
+    def convert(self, red, green, blue):
+        return _rgb_to_lab(red, green, blue)
+
+    def distance(self, lab1, lab2):
+        (l1, a1, b1) = lab1
+        (l2, a2, b2) = lab2
+        return (l1 - l2) ** 2 + (a1 - a2) ** 2 + (b1 - b2) ** 2
+
+    def array_distance(self, lab1, lab2):
+        return ((lab1 - lab2) ** 2).sum(axis=-1)
+
+@register_metric
+class CIEDE2000Metric(Metric):
+    '''
+    CIEDE2000 Delta E, following Sharma, Wu and Dalal, "The CIEDE2000
+    Color-Difference Formula: Implementation Notes, Supplementary Test Data,
+    and Mathematical Observations" (2005). Coordinates are (L*, a*, b*, C*),
+    so the palette's chroma is computed once.
+    '''
+    name = 'ciede2000'
+    description = 'CIEDE2000 Delta E'
+    squared = False
+
+    def convert(self, red, green, blue):
+        (l, a, b) = _rgb_to_lab(red, green, blue)
+        return (l, a, b, math.hypot(a, b))
+
+    def distance(self, lab1, lab2):
+        (l1, a1, b1, c1) = lab1
+        (l2, a2, b2, c2) = lab2
+
+        c_mean7 = ((c1 + c2) / 2) ** 7
+        g = 0.5 * (1 - math.sqrt(c_mean7 / (c_mean7 + 25 ** 7)))
+        a1 *= 1 + g
+        a2 *= 1 + g
+        c1 = math.hypot(a1, b1)
+        c2 = math.hypot(a2, b2)
+        h1 = math.degrees(math.atan2(b1, a1)) % 360 if c1 else 0.0
+        h2 = math.degrees(math.atan2(b2, a2)) % 360 if c2 else 0.0
+
+        dl = l2 - l1
+        dc = c2 - c1
+        if c1 * c2 == 0:
+            dh = 0.0
+            h_mean = h1 + h2
+        else:
+            dh = h2 - h1
+            if dh > 180:
+                dh -= 360
+            elif dh < -180:
+                dh += 360
+            if abs(h1 - h2) <= 180:
+                h_mean = (h1 + h2) / 2
+            elif h1 + h2 < 360:
+                h_mean = (h1 + h2 + 360) / 2
+            else:
+                h_mean = (h1 + h2 - 360) / 2
+        dh = 2 * math.sqrt(c1 * c2) * math.sin(math.radians(dh / 2))
+
+        l_mean = (l1 + l2) / 2
+        c_mean = (c1 + c2) / 2
+        t = (1 - 0.17 * math.cos(math.radians(h_mean - 30))
+               + 0.24 * math.cos(math.radians(2 * h_mean))
+               + 0.32 * math.cos(math.radians(3 * h_mean + 6))
+               - 0.20 * math.cos(math.radians(4 * h_mean - 63)))
+        d_theta = 30 * math.exp(-((h_mean - 275) / 25) ** 2)
+        c_mean7 = c_mean ** 7
+        r_c = 2 * math.sqrt(c_mean7 / (c_mean7 + 25 ** 7))
+        l_term = (l_mean - 50) ** 2
+        s_l = 1 + 0.015 * l_term / math.sqrt(20 + l_term)
+        s_c = 1 + 0.045 * c_mean
+        s_h = 1 + 0.015 * c_mean * t
+        r_t = -math.sin(math.radians(2 * d_theta)) * r_c
+
+        dl /= s_l
+        dc /= s_c
+        dh /= s_h
+        return math.sqrt(dl * dl + dc * dc + dh * dh + r_t * dc * dh)
+
+    def array_distance(self, lab1, lab2):
+        # The same steps as distance, with numpy.where for the branches.
+        where = numpy.where
+        (l1, a1, b1, c1) = [lab1[..., i] for i in range(4)]
+        (l2, a2, b2, c2) = [lab2[..., i] for i in range(4)]
+
+        c_mean7 = ((c1 + c2) / 2) ** 7
+        g = 0.5 * (1 - numpy.sqrt(c_mean7 / (c_mean7 + 25 ** 7)))
+        a1 = a1 * (1 + g)
+        a2 = a2 * (1 + g)
+        c1 = numpy.hypot(a1, b1)
+        c2 = numpy.hypot(a2, b2)
+        h1 = where(c1 != 0, numpy.degrees(numpy.arctan2(b1, a1)) % 360, 0.0)
+        h2 = where(c2 != 0, numpy.degrees(numpy.arctan2(b2, a2)) % 360, 0.0)
+
+        dl = l2 - l1
+        dc = c2 - c1
+        achromatic = c1 * c2 == 0
+        dh = h2 - h1
+        dh = where(dh > 180, dh - 360, where(dh < -180, dh + 360, dh))
+        dh = where(achromatic, 0.0, dh)
+        h_sum = h1 + h2
+        h_mean = where(abs(h1 - h2) <= 180, h_sum / 2,
+                       where(h_sum < 360, (h_sum + 360) / 2,
+                             (h_sum - 360) / 2))
+        h_mean = where(achromatic, h_sum, h_mean)
+        dh = 2 * numpy.sqrt(c1 * c2) * numpy.sin(numpy.radians(dh / 2))
+
+        l_mean = (l1 + l2) / 2
+        c_mean = (c1 + c2) / 2
+        t = (1 - 0.17 * numpy.cos(numpy.radians(h_mean - 30))
+               + 0.24 * numpy.cos(numpy.radians(2 * h_mean))
+               + 0.32 * numpy.cos(numpy.radians(3 * h_mean + 6))
+               - 0.20 * numpy.cos(numpy.radians(4 * h_mean - 63)))
+        d_theta = 30 * numpy.exp(-((h_mean - 275) / 25) ** 2)
+        c_mean7 = c_mean ** 7
+        r_c = 2 * numpy.sqrt(c_mean7 / (c_mean7 + 25 ** 7))
+        l_term = (l_mean - 50) ** 2
+        s_l = 1 + 0.015 * l_term / numpy.sqrt(20 + l_term)
+        s_c = 1 + 0.045 * c_mean
+        s_h = 1 + 0.015 * c_mean * t
+        r_t = -numpy.sin(numpy.radians(2 * d_theta)) * r_c
+
+        dl = dl / s_l
+        dc = dc / s_c
+        dh = dh / s_h
+        return numpy.sqrt(dl * dl + dc * dc + dh * dh + r_t * dc * dh)
+
+def _srgb_to_linear(level):
+    v = level / 255
+    if v <= 0.04045:
+        return v / 12.92
+    return ((v + 0.055) / 1.055) ** 2.4
+
+# sRGB channel level (0-255) -> linear light (0.0-1.0)
+_linear_levels = [_srgb_to_linear(level) for level in range(256)]
+
+# sRGB channel level -> its (X, Y, Z) contribution, relative to the D65 white
+# point, for each of red, green and blue.
+_xyz_levels = [
+    [(x * lin / 0.95047, y * lin, z * lin / 1.08883)
+     for lin in _linear_levels]
+    for (x, y, z) in ((0.4124564, 0.2126729, 0.0193339),
+                      (0.3575761, 0.7151522, 0.1191920),
+                      (0.1804375, 0.0721750, 0.9503041))
+]
+
+_lab_cache = {} # {(red, green, blue) : (L*, a*, b*)}
+
+def _lab_f(t):
+    if t > (6 / 29) ** 3:
+        return t ** (1 / 3)
+    return t / (3 * (6 / 29) ** 2) + 4 / 29
+
+def _rgb_to_lab(red, green, blue):
+    '''
+    Return the CIELAB coordinates of an sRGB color, using the D65 white.
+    '''
+    key = (red, green, blue)
+    lab = _lab_cache.get(key)
+    if lab is None:
+        (xr, yr, zr) = _xyz_levels[0][red]
+        (xg, yg, zg) = _xyz_levels[1][green]
+        (xb, yb, zb) = _xyz_levels[2][blue]
+        fx = _lab_f(xr + xg + xb)
+        fy = _lab_f(yr + yg + yb)
+        fz = _lab_f(zr + zg + zb)
+        lab = _lab_cache[key] = (116 * fy - 16, 500 * (fx - fy),
+                                 200 * (fy - fz))
+    return lab
+
+def nearest_xterm_many(colors, count=1, max_grays=1, use_numpy=None,
+                       palette=None):
+    '''
+    Find the nearest colors in palette (a Palette or a name for get_palette,
+    xterm-256 by default) for a whole sequence of colors at once, according
+    to color_distance. colors can hold Color objects or (red, green, blue)
+    tuples. count and max_grays have the same meaning as for
+    Color._nearest_xterms, and the results are the same, including the
+    handling of ties.
+
+    Returns (xterms, distances). With count == 1 these are lists with one
+    item per color, otherwise each item is a list of up to count entries
+    sorted by distance.
+
+    The distances are computed as one NumPy array operation when NumPy is
+    available, unless use_numpy is False. Overrides are not applied.
+    '''
+    rgbs = [_as_rgb(c) for c in colors]
+    palette = get_palette(palette)
+    if use_numpy is None:
+        use_numpy = numpy is not None
+
+    if use_numpy:
+        return _nearest_xterm_many_numpy(rgbs, count, max_grays, palette)
+    else:
+        return _nearest_xterm_many_python(rgbs, count, max_grays, palette)
+
+def _as_rgb(c):
+    if isinstance(c, Color):
+        return (c.red, c.green, c.blue)
+    else:
+        (r, g, b) = c
+        return (int(r), int(g), int(b))
+
+def _nearest_xterm_many_python(rgbs, count, max_grays, palette):
+    metric = get_metric('weighted-rgb', palette)
+    xterms = []
+    distances = []
+    for (r, g, b) in rgbs:
+        c = Color(r, g, b)
+        if count == 1:
+            xterm = palette.nearest_table().lookup(r, g, b)
+            xterms.append(xterm)
+            distances.append(color_distance(c, palette.color(xterm)))
+        else:
+            nearest = metric.nearest_xterms(c, count, max_grays)
+            xterms.append([x for (dist, x) in nearest])
+            distances.append([dist for (dist, x) in nearest])
+
+    return (xterms, distances)
+
+def _nearest_xterm_many_numpy(rgbs, count, max_grays, palette):
+    if not rgbs:
+        return ([], [])
+
+    grays = palette.grays
+    palette = numpy.array(palette.ranked, dtype=numpy.int64)
+    pal_xterm = palette[:, 0]
+    colors = numpy.array(rgbs, dtype=numpy.int64)
+
+    # One row per color, one column per palette entry, columns in
+    # tie-breaking order.
+    rmean = (colors[:, 0:1] + palette[:, 1]) // 2
+    r = colors[:, 0:1] - palette[:, 1]
+    g = colors[:, 1:2] - palette[:, 2]
+    b = colors[:, 2:3] - palette[:, 3]
+    dists = ((((512 + rmean) * r * r) >> 8) + 4 * g * g +
+             (((767 - rmean) * b * b) >> 8))
+
+    if count == 1:
+        # argmin returns the first minimum, which is the tie-break winner.
+        best = dists.argmin(axis=1)
+        rows = numpy.arange(len(rgbs))
+        return (pal_xterm[best].tolist(), dists[rows, best].tolist())
+
+    # Hide all but the nearest max_grays grays, then take the nearest count
+    # entries. Stable sorts keep the tie-breaking order of the columns.
+    is_gray = numpy.array([x in grays for x in pal_xterm.tolist()],
+                          dtype=bool)
+    gray_cols = numpy.nonzero(is_gray)[0]
+    gray_order = dists[:, gray_cols].argsort(axis=1, kind='mergesort')
+    hidden = gray_cols[gray_order[:, max_grays:]]
+    rows = numpy.arange(len(rgbs))[:, numpy.newaxis]
+    available = len(palette) - len(gray_cols) + min(max_grays,
+                                                     len(gray_cols))
+    dists[rows, hidden] = numpy.iinfo(numpy.int64).max
+
+    order = dists.argsort(axis=1, kind='mergesort')[:, :min(count, available)]
+    return (pal_xterm[order].tolist(), dists[rows, order].tolist())
+
+class NearestTable(object):
+    '''
+    Precomputed map from every 24-bit RGB color to the nearest color in a
+    Palette according to color_distance.
+
+    The RGB cube is split into cells of (1 << shift) values per channel.
+    Each cell records the xterm colors that could be nearest for some color
+    in the cell. Most cells have only one, so the lookup is a single read.
+    The rest are resolved exactly from their short candidate list.
+
+    The table is written to a file once and memory-mapped after that, so
+    every process doing conversions shares it through the page cache. The
+    header holds the palette's digest, so a table is never used with the
+    wrong colors.
+    '''
+
+    magic = 'VXCT'
+    version = 2
+    shift = 2
+
+    _header = struct.Struct('<4sHH16s')
+    _cell = struct.Struct('<I')
+
+    def __init__(self, data, palette):
+        (magic, version, shift, digest) = self._header.unpack_from(data)
+        if magic != self.magic or version != self.version or \
+           digest != palette.digest:
+            raise ValueError('Bad nearest color table')
+
+        self._data = data
+        self._palette = palette
+        self._shift = shift
+        self._size = 256 >> shift
+        self._candidates = (self._header.size +
+                            self._cell.size * self._size ** 3)
+
+    @classmethod
+    def load(cls, filename, palette):
+        '''
+        Memory-map the table for palette in filename, creating the file
+        first if it doesn't exist or is out of date. If the file can't be
+        written the table is kept in memory instead.
+        '''
+        return _load_table(cls, filename, lambda: cls.generate(palette),
+                           palette)
+
+    @classmethod
+    def generate(cls, palette, shift=None):
+        '''
+        Build the table data for palette, returned as a string.
+        '''
+        if shift is None:
+            shift = cls.shift
+        size = 256 >> shift
+        cells = [0] * size ** 3
+        candidates = [] # flattened candidate lists
+        offsets = {} # {(xterm, ...) : offset in candidates}
+
+        # Subdivide the RGB cube like an octree, keeping only the palette
+        # entries that can still be nearest within each box.
+        stack = [(0, 0, 0, 256, palette.ranked)]
+        while stack:
+            (r, g, b, width, entries) = stack.pop()
+            entries = _box_candidates(r, g, b, width, entries)
+            if width > (1 << shift) and len(entries) > 1:
+                half = width // 2
+                for dr in (0, half):
+                    for dg in (0, half):
+                        for db in (0, half):
+                            stack.append((r + dr, g + dg, b + db, half,
+                                          entries))
+                continue
+
+            key = tuple(e[0] for e in entries)
+            if key not in offsets:
+                offsets[key] = len(candidates)
+                candidates.extend(key)
+            entry = (offsets[key] << 8) | len(key)
+
+            # Fill every cell covered by this box.
+            cr = r >> shift
+            cg = g >> shift
+            cb = b >> shift
+            span = max(width >> shift, 1)
+            for i in range(cr, cr + span):
+                for j in range(cg, cg + span):
+                    start = (i * size + j) * size + cb
+                    cells[start:start + span] = [entry] * span
+
+        return ''.join([
+            cls._header.pack(cls.magic, cls.version, shift, palette.digest),
+            struct.pack('<%dI' % len(cells), *cells),
+            ''.join(chr(x) for x in candidates),
+        ])
+
+    def lookup(self, red, green, blue):
+        shift = self._shift
+        size = self._size
+        index = (((red >> shift) * size + (green >> shift)) * size +
+                 (blue >> shift))
+        (entry,) = self._cell.unpack_from(
+            self._data, self._header.size + self._cell.size * index)
+
+        start = self._candidates + (entry >> 8)
+        count = entry & 0xff
+        if count == 1:
+            return ord(self._data[start])
+
+        # Exact refinement among the remaining candidates, which are stored
+        # in tie-breaking order.
+        color = Color(red, green, blue)
+        best = None
+        for x in self._data[start:start + count]:
+            xterm = ord(x)
+            dist = color_distance(color, self._palette.color(xterm))
+            if best is None or dist < best[0]:
+                best = (dist, xterm)
+
+        return best[1]
+
+class NameTable(object):
+    '''
+    Compiled color name database: the X rgb database plus
+    _extra_color_names, stored as a sorted file that is memory-mapped and
+    searched by bisection. Reading it costs nothing at startup, unlike
+    running showrgb.
+
+    The header records where the X names came from (an rgb.txt file, or
+    showrgb) and a digest of what the names were made from (see
+    _color_names_digest), so the table is rebuilt when _extra_color_names
+    or the X database changes.
+    '''
+
+    magic = 'VXCN'
+    version = 2
+
+    _header = struct.Struct('<4sHI16sH') # ..., digest, source name length
+    _record = struct.Struct('<I4B') # name offset, name length, r, g, b
+
+    def __init__(self, data, check_digest=True):
+        (magic, version, count, digest, source_length) = \
+            self._header.unpack_from(data)
+        if magic != self.magic or version != self.version:
+            raise ValueError('Bad color name table')
+        source = data[self._header.size:self._header.size + source_length]
+        if check_digest and digest != _color_names_digest(source or None):
+            raise ValueError('Out of date color name table')
+
+        self._data = data
+        self._count = count
+        self._records = self._header.size + source_length
+        self._names = self._records + self._record.size * count
+
+    @classmethod
+    def load(cls, filename, rgb_file=None):
+        '''
+        Memory-map the table in filename, creating it first if it doesn't
+        exist or is out of date. See _get_color_names for rgb_file. If an out
+        of date table can't be rebuilt (X is gone, say), it's used anyway,
+        with a warning.
+        '''
+        try:
+            return _load_table(cls, filename, lambda: cls.generate(rgb_file))
+        except (IOError, OSError), e:
+            error = sys.exc_info()
+            try:
+                table = cls(_map_file(filename), check_digest=False)
+            except (IOError, OSError, ValueError, struct.error):
+                raise error[0], error[1], error[2]
+            print >> sys.stderr, ('Warning: using the out of date color '
+                                  'names in %s: %s' % (filename, e))
+            return table
+
+    @classmethod
+    def generate(cls, rgb_file=None):
+        '''
+        Build the table data, returned as a string.
+        '''
+        source = rgb_file or ''
+        digest = _color_names_digest(rgb_file)
+        names = sorted(_get_color_names(rgb_file).items())
+
+        records = []
+        strings = []
+        offset = 0
+        for (name, c) in names:
+            records.append(cls._record.pack(offset, len(name), c.red,
+                                            c.green, c.blue))
+            strings.append(name)
+            offset += len(name)
+
+        header = cls._header.pack(cls.magic, cls.version, len(names), digest,
+                                  len(source))
+        return ''.join([header, source] + records + strings)
+
+    def _entry(self, i):
+        (offset, length, r, g, b) = self._record.unpack_from(
+            self._data, self._records + self._record.size * i)
+        start = self._names + offset
+        return (self._data[start:start + length], r, g, b)
+
+    def get(self, name, default=None):
+        '''
+        Return the Color for the lowercase name, or default.
+        '''
+        lo = 0
+        hi = self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < name:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < self._count:
+            (found, r, g, b) = self._entry(lo)
+            if found == name:
+                return Color(r, g, b)
+
+        return default
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+def _load_table(cls, filename, generate, *args):
+    '''
+    Return an instance of the table class cls for the file filename,
+    memory-mapped. If the file is missing or invalid, it is created from the
+    data returned by generate(). If it can't be written, the table is kept
+    in memory instead. args are passed on to cls after the data.
+    '''
+    try:
+        return cls(_map_file(filename), *args)
+    except (IOError, OSError, ValueError, struct.error):
+        pass
+
+    data = generate()
+    try:
+        _write_file(filename, data)
+        return cls(_map_file(filename), *args)
+    except (IOError, OSError):
+        return cls(data, *args)
+
+def _map_file(filename):
+    f = open(filename, 'rb')
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+def _write_file(filename, data):
+    # Write to a temporary name and rename so that concurrent processes
+    # never map a partial file.
+    tmpname = '%s.%d' % (filename, os.getpid())
+    f = open(tmpname, 'wb')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    os.rename(tmpname, filename)
+
+def _box_candidates(red, green, blue, width, entries):
+    '''
+    Return the entries from the (xterm, r, g, b) list that might be the
+    nearest color to some color in the box of the given width. This uses
+    lower and upper bounds of color_distance over the box.
+    '''
+    hi = width - 1
+    bounds = []
+    for entry in entries:
+        (xterm, pr, pg, pb) = entry
+        (r_min, r_max) = _square_range(red, red + hi, pr)
+        (g_min, g_max) = _square_range(green, green + hi, pg)
+        (b_min, b_max) = _square_range(blue, blue + hi, pb)
+        rmean_lo = (red + pr) // 2
+        rmean_hi = (red + hi + pr) // 2
+        lower = ((((512 + rmean_lo) * r_min) >> 8) + 4 * g_min +
+                 (((767 - rmean_hi) * b_min) >> 8))
+        upper = ((((512 + rmean_hi) * r_max) >> 8) + 4 * g_max +
+                 (((767 - rmean_lo) * b_max) >> 8))
+        bounds.append((lower, upper, entry))
+
+    limit = min(upper for (lower, upper, entry) in bounds)
+    return [entry for (lower, upper, entry) in bounds if lower <= limit]
+
+def _square_range(lo, hi, value):
+    '''
+    Return the (min, max) of (x - value)**2 for lo <= x <= hi.
+    '''
+    low = (lo - value) ** 2
+    high = (hi - value) ** 2
+    if lo <= value <= hi:
+        return (0, max(low, high))
+    return (min(low, high), max(low, high))
+
 _x_rgb_matcher = re.compile(r'''
     \s*(?P<r>[0-9]+)
     \s+(?P<g>[0-9]+)
@@ -173,11 +1283,30 @@ _x_rgb_matcher = re.compile(r'''
     \s+(?P<name>.*)\n
 ''', re.VERBOSE)
 
-def _get_x_rgb():
+# Used when showrgb isn't available.
+_rgb_files = ['/usr/share/X11/rgb.txt', '/etc/X11/rgb.txt',
+              '/usr/lib/X11/rgb.txt', '/usr/X11R6/lib/X11/rgb.txt']
+
+def _get_x_rgb(rgb_file=None):
+    if rgb_file is None:
+        try:
+            proc = subprocess.Popen(['showrgb'], stdout=subprocess.PIPE)
+            (text, stderr) = proc.communicate()
+        except OSError:
+            existing = [f for f in _rgb_files if os.path.exists(f)]
+            if not existing:
+                raise
+            rgb_file = existing[0]
+
+    if rgb_file is not None:
+        f = open(rgb_file)
+        try:
+            text = f.read()
+        finally:
+            f.close()
+
     result = {}
-    proc = subprocess.Popen(['showrgb'], stdout=subprocess.PIPE)
-    (stdout, stderr) = proc.communicate()
-    for m in _x_rgb_matcher.finditer(stdout):
+    for m in _x_rgb_matcher.finditer(text):
         name = m.group('name').lower()
         color = Color(int(m.group('r')),
                       int(m.group('g')),
@@ -195,20 +1324,78 @@ _extra_color_names = {
     'darkyellow'     : Color(0xbb, 0xbb, 0x00),
 }
 
-def _get_color_names():
-    result = _get_x_rgb()
+def _color_names_digest(rgb_file=None):
+    '''
+    Return a digest of _extra_color_names and the size and modification
+    time of rgb_file, or of the rgb.txt files that showrgb reads if
+    rgb_file is None. Running showrgb would take as long as rebuilding the
+    name table, so the files stand in for its output.
+    '''
+    if rgb_file is None:
+        files = _rgb_files
+    else:
+        files = [rgb_file]
+
+    stats = []
+    for filename in files:
+        try:
+            st = os.stat(filename)
+        except OSError:
+            stats.append((filename, None))
+        else:
+            stats.append((filename, st.st_size, st.st_mtime))
+
+    return hashlib.md5(repr((sorted(_extra_color_names.items()),
+                             stats))).digest()
+
+def _get_color_names(rgb_file=None):
+    '''
+    Return {'name' : Color()} for all known color names. The X names come
+    from showrgb, or from rgb_file if given.
+    '''
+    result = _get_x_rgb(rgb_file)
     result.update(_extra_color_names)
     return result
 
+Color.set_metric(default_metric)
+
 if __name__ == '__main__':
-    import math
+    import optparse
+
+    parser = optparse.OptionParser(usage='%prog [options] COLOR...')
+    parser.add_option('--rgb-file', metavar='FILE',
+        help='rebuild the color name table from FILE (an X rgb.txt)')
+    parser.add_option('-m', '--metric', default=default_metric,
+        choices=metric_names(),
+        help='color metric to use: %s (default: %s)'
+             % (', '.join(metric_names()), default_metric))
+    parser.add_option('-p', '--palette', default=default_palette,
+        help='palette to choose from: %s or a palette file (default: %s)'
+             % (', '.join(palette_names()), default_palette))
+    (opts, arguments) = parser.parse_args()
+
+    try:
+        palette = get_palette(opts.palette)
+    except (IOError, ValueError), e:
+        parser.error(str(e))
+
+    if opts.rgb_file is not None:
+        _write_file(Color.color_names_path,
+                    NameTable.generate(opts.rgb_file))
 
-    for color in sys.argv[1:]:
+    names = []
+    colors = []
+    for color in arguments:
         try:
-            c = Color.from_string(color)
+            colors.append(Color.from_string(color))
         except ValueError:
             continue
+        names.append(color)
 
-        dists = c._nearest_xterms(8, 2)
-        pieces = ['%d (%f)' % (x, math.sqrt(d)) for (d, x) in dists]
+    metric = get_metric(opts.metric, palette)
+    for (color, c) in zip(names, colors):
+        nearest = metric.nearest_xterms(c, 8, 2)
+        if metric.squared:
+            nearest = [(math.sqrt(d), x) for (d, x) in nearest]
+        pieces = ['%d (%f)' % (x, d) for (d, x) in nearest]
         print '%s = %r: %s' % (color, c, ', '.join(pieces))
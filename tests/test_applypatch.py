@@ -0,0 +1,177 @@
+# Copyright 2010 Kevin Goodsell
+#
+# This file is part of vim-xterm-colors.
+#
+# vim-xterm-colors is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License Version 2
+# as published by the Free Software Foundation.
+#
+# vim-xterm-colors is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with vim-xterm-colors.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+# Run with 'python -m unittest discover tests' from the top directory.
+
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+scripts_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))), 'scripts')
+sys.path.insert(0, scripts_dir)
+# applypatch doesn't end in .py, so keep load_source from writing
+# scripts/applypatchc.
+dont_write_bytecode = sys.dont_write_bytecode
+sys.dont_write_bytecode = True
+try:
+    applypatch = imp.load_source('applypatch',
+                                 os.path.join(scripts_dir, 'applypatch'))
+finally:
+    sys.dont_write_bytecode = dont_write_bytecode
+
+# The expected results are what GNU patch 2.7.6 gives for the same input.
+
+original = ''.join('line %d\n' % i for i in range(1, 21))
+patched = original.replace('line 10\n', 'line ten\n')
+
+one_hunk = '''\
+--- a
++++ b
+@@ -7,7 +7,7 @@
+ line 7
+ line 8
+ line 9
+-line 10
++line ten
+ line 11
+ line 12
+ line 13
+'''
+
+two_hunks = '''\
+--- a
++++ b
+@@ -2,4 +2,5 @@
+ line 2
+ line 3
++line 3.5
+ line 4
+ line 5
+@@ -15,5 +16,5 @@
+ line 15
+ line 16
+-line 17
++line seventeen
+ line 18
+ line 19
+'''
+
+class ApplyPatchTest(unittest.TestCase):
+    def check(self, data, diff, result, messages, max_fuzz=2):
+        self.assertEqual(applypatch.apply_patch(data, diff, max_fuzz),
+                         (result, messages, 0))
+
+    def check_failed(self, data, diff, messages, failed=1, max_fuzz=2):
+        (result, got_messages, got_failed) = applypatch.apply_patch(
+            data, diff, max_fuzz)
+        self.assertEqual((got_messages, got_failed), (messages, failed))
+
+    def test_exact(self):
+        self.check(original, one_hunk, patched, [])
+
+    def test_offset(self):
+        self.check('a\nb\nc\n' + original, one_hunk, 'a\nb\nc\n' + patched,
+                   ['Hunk #1 succeeded at 10 (offset 3 lines).'])
+        self.check('a\n' + original, one_hunk, 'a\n' + patched,
+                   ['Hunk #1 succeeded at 8 (offset 1 line).'])
+        self.check(original.replace('line 2\n', ''), one_hunk,
+                   patched.replace('line 2\n', ''),
+                   ['Hunk #1 succeeded at 6 (offset -1 lines).'])
+
+    def test_offset_carries_over(self):
+        data = original.replace('line 10\n', 'line 10\nextra\n')
+        self.check(data, two_hunks,
+                   data.replace('line 3\n', 'line 3\nline 3.5\n')
+                       .replace('line 17\n', 'line seventeen\n'),
+                   ['Hunk #2 succeeded at 17 (offset 1 line).'])
+
+    def test_fuzz(self):
+        # Context lines that didn't match are kept as they are in the file.
+        data = original.replace('line 7\n', 'LINE 7\n')
+        self.check(data, one_hunk, data.replace('line 10\n', 'line ten\n'),
+                   ['Hunk #1 succeeded at 7 with fuzz 1.'])
+        data = data.replace('line 8\n', 'LINE 8\n')
+        self.check(data, one_hunk, data.replace('line 10\n', 'line ten\n'),
+                   ['Hunk #1 succeeded at 7 with fuzz 2.'])
+
+    def test_fuzz_limit(self):
+        data = original.replace('line 7\n', 'LINE 7\n') \
+                       .replace('line 8\n', 'LINE 8\n')
+        self.check_failed(data, one_hunk, ['Hunk #1 FAILED at 7.',
+                                           '1 out of 1 hunk FAILED'],
+                          max_fuzz=1)
+        data = data.replace('line 9\n', 'LINE 9\n')
+        self.check_failed(data, one_hunk, ['Hunk #1 FAILED at 7.',
+                                           '1 out of 1 hunk FAILED'])
+
+    def test_reversed(self):
+        # patch asks whether to reverse an already applied patch, and skips
+        # it when nobody answers. It isn't applied here either.
+        self.check_failed(patched, one_hunk, ['Hunk #1 FAILED at 7.',
+                                              '1 out of 1 hunk FAILED'])
+
+    def test_one_of_two_failed(self):
+        data = original.replace('line 17\n', 'changed\n')
+        (result, messages, failed) = applypatch.apply_patch(data, two_hunks)
+        self.assertEqual((messages, failed), (['Hunk #2 FAILED at 16.',
+                                               '1 out of 2 hunks FAILED'], 1))
+        self.assertEqual(result, data.replace('line 3\n',
+                                              'line 3\nline 3.5\n'))
+
+    def test_bad_diff(self):
+        self.assertRaises(applypatch.PatchError, applypatch.apply_patch,
+                          original, '@@ -1,1 +1,1 @@\n-line 1\n+one\n')
+        self.assertRaises(applypatch.PatchError, applypatch.apply_patch,
+                          original, '--- a\n+++ b\n@@ -1,2 +1,2 @@\n-line 1\n')
+
+class RunCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='applypatch-test')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        filename = os.path.join(self.dir, name)
+        applypatch.write_file(filename, data)
+        return filename
+
+    def test_applied(self):
+        original_file = self.write('original', 'a\n' + original)
+        diff_file = self.write('diff', one_hunk)
+        output = os.path.join(self.dir, 'output')
+        self.assertEqual(
+            applypatch.run_command(['-o', output, original_file, diff_file]),
+            (0, 'Hunk #1 succeeded at 8 (offset 1 line).\n'))
+        self.assertEqual(applypatch.read_file(output), 'a\n' + patched)
+
+    def test_rejected(self):
+        original_file = self.write('original', patched)
+        diff_file = self.write('diff', one_hunk)
+        output = os.path.join(self.dir, 'output')
+        self.assertEqual(
+            applypatch.run_command(['-o', output, original_file, diff_file]),
+            (1, 'Hunk #1 FAILED at 7.\n1 out of 1 hunk FAILED\n'
+                'not writing %s\n' % output))
+        self.assertFalse(os.path.exists(output))
+
+if __name__ == '__main__':
+    unittest.main()
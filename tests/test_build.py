@@ -0,0 +1,72 @@
+# Copyright 2010 Kevin Goodsell
+#
+# This file is part of vim-xterm-colors.
+#
+# vim-xterm-colors is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License Version 2
+# as published by the Free Software Foundation.
+#
+# vim-xterm-colors is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with vim-xterm-colors.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+# Run with 'python -m unittest discover tests' from the top directory.
+
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class CleanTest(unittest.TestCase):
+    def setUp(self):
+        # The build is run in a copy of the tree, without the color tables
+        # that earlier runs left in scripts/.
+        self.dir = tempfile.mkdtemp(prefix='build-test')
+        for name in ('build', 'fabricate.py'):
+            shutil.copy2(os.path.join(root_dir, name), self.dir)
+        for name in ('originals', 'patches', 'scripts'):
+            shutil.copytree(os.path.join(root_dir, name),
+                            os.path.join(self.dir, name),
+                            ignore=shutil.ignore_patterns('*.pyc', '*.tbl'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def build(self, *args):
+        command = [sys.executable, 'build', '-q'] + list(args)
+        devnull = open(os.devnull, 'w')
+        try:
+            status = subprocess.call(command, cwd=self.dir, stdout=devnull,
+                                     stderr=subprocess.STDOUT)
+        finally:
+            devnull.close()
+        self.assertEqual(status, 0, '%s failed' % ' '.join(command))
+
+    def tables(self):
+        result = {}
+        for filename in glob.glob(os.path.join(self.dir, 'scripts', '*.tbl')):
+            st = os.stat(filename)
+            result[os.path.basename(filename)] = (st.st_ino, st.st_mtime)
+        return result
+
+    def test_clean_keeps_tables(self):
+        # The tables are written by gui2xterm's batch run, but they aren't
+        # outputs of any one scheme, so --clean mustn't delete them.
+        self.build()
+        tables = self.tables()
+        self.assertTrue(tables)
+        self.build('--clean')
+        self.assertEqual(self.tables(), tables)
+
+if __name__ == '__main__':
+    unittest.main()
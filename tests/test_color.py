@@ -0,0 +1,358 @@
+# Copyright 2010 Kevin Goodsell
+#
+# This file is part of vim-xterm-colors.
+#
+# vim-xterm-colors is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License Version 2
+# as published by the Free Software Foundation.
+#
+# vim-xterm-colors is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with vim-xterm-colors.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+# Run with 'python -m unittest discover tests' from the top directory.
+
+import cPickle
+import math
+import os
+import pickle
+import random
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'scripts'))
+import color
+
+def random_rgbs(count, seed):
+    rand = random.Random(seed)
+    return [(rand.randrange(256), rand.randrange(256), rand.randrange(256))
+            for i in range(count)]
+
+def brute_force(palette, rgb):
+    '''
+    Return [(distance, xterm)] for every color in palette, nearest first,
+    with ties in tie-breaking order.
+    '''
+    c = color.Color(*rgb)
+    dists = sorted((color.color_distance(c, palette.color(xterm)), rank, xterm)
+                   for (rank, (xterm, r, g, b)) in enumerate(palette.ranked))
+    return [(dist, xterm) for (dist, rank, xterm) in dists]
+
+# Colors on the edges of the table's cells and of the RGB cube.
+edge_rgbs = [(r, g, b) for r in (0, 3, 4, 95, 135, 255)
+                       for g in (0, 7, 8, 175)
+                       for b in (0, 1, 215, 252, 255)]
+
+class NearestTableTest(unittest.TestCase):
+    def check_palette(self, palette, rgbs):
+        table = palette.nearest_table()
+        for rgb in rgbs:
+            self.assertEqual(table.lookup(*rgb),
+                             brute_force(palette, rgb)[0][1],
+                             '%s: %r' % (palette.name, rgb))
+
+    def test_builtin_palettes(self):
+        for name in color.palette_names():
+            palette = color.get_palette(name)
+            rgbs = random_rgbs(1000, seed=len(palette)) + edge_rgbs + \
+                   [(r, g, b) for (xterm, r, g, b) in palette.ranked]
+            self.check_palette(palette, rgbs)
+
+    def test_ties(self):
+        # 16 and 18 are the same color, and 17 is as far from (0, 0, 2) as
+        # they are. The first in the palette's order wins.
+        palette = color.Palette('ties', [(17, color.Color(0, 0, 4)),
+                                         (16, color.Color(0, 0, 0)),
+                                         (18, color.Color(0, 0, 0))])
+        table = color.NearestTable(color.NearestTable.generate(palette),
+                                   palette)
+        self.assertEqual(table.lookup(0, 0, 2), 17)
+        self.assertEqual(table.lookup(0, 0, 1), 16)
+        for rgb in random_rgbs(200, seed=1) + edge_rgbs:
+            self.assertEqual(table.lookup(*rgb),
+                             brute_force(palette, rgb)[0][1])
+
+    def test_wrong_palette(self):
+        data = color.NearestTable.generate(color.get_palette('xterm-16'))
+        self.assertRaises(ValueError, color.NearestTable, data,
+                          color.get_palette('xterm-88'))
+
+def brute_force_top(palette, rgb, count, max_grays):
+    if count == 1:
+        max_grays = 1
+    result = []
+    grays = 0
+    for (dist, xterm) in brute_force(palette, rgb):
+        if xterm in palette.grays:
+            if grays >= max_grays:
+                continue
+            grays += 1
+        result.append((dist, xterm))
+    return result[:count]
+
+class NearestXtermsTest(unittest.TestCase):
+    def setUp(self):
+        self.palette = color.get_palette('xterm-256')
+        self.rgbs = random_rgbs(300, seed=2) + edge_rgbs
+
+    def test_whole_palette(self):
+        # With every gray allowed, the searches give the whole palette in
+        # order of distance.
+        everything = len(self.palette)
+        for rgb in self.rgbs:
+            self.assertEqual(
+                color.Color(*rgb)._nearest_xterms(everything, everything),
+                brute_force(self.palette, rgb))
+
+    def test_top_k(self):
+        for rgb in self.rgbs:
+            c = color.Color(*rgb)
+            for (count, max_grays) in ((1, 1), (1, 5), (5, 1), (5, 3),
+                                       (20, 0), (20, 2)):
+                self.assertEqual(c._nearest_xterms(count, max_grays),
+                                 brute_force_top(self.palette, rgb, count,
+                                                 max_grays),
+                                 '%r %d %d' % (rgb, count, max_grays))
+
+    def test_many_python(self):
+        rgbs = self.rgbs[:100]
+        (xterms, distances) = color.nearest_xterm_many(rgbs, count=5,
+                                                       max_grays=2,
+                                                       use_numpy=False)
+        for (rgb, x, d) in zip(rgbs, xterms, distances):
+            self.assertEqual(zip(d, x),
+                             color.Color(*rgb)._nearest_xterms(5, 2))
+
+    @unittest.skipIf(color.numpy is None, 'NumPy is not installed')
+    def test_many_numpy(self):
+        rgbs = self.rgbs + [color.Color(1, 2, 3)]
+        for name in color.palette_names():
+            for (count, max_grays) in ((1, 1), (5, 1), (5, 3), (12, 0)):
+                self.assertEqual(
+                    color.nearest_xterm_many(rgbs, count, max_grays,
+                                             use_numpy=True, palette=name),
+                    color.nearest_xterm_many(rgbs, count, max_grays,
+                                             use_numpy=False, palette=name),
+                    '%s %d %d' % (name, count, max_grays))
+        self.assertEqual(color.nearest_xterm_many([], use_numpy=True),
+                         ([], []))
+
+# Test data from Sharma, Wu and Dalal, "The CIEDE2000 Color-Difference
+# Formula: Implementation Notes, Supplementary Test Data, and Mathematical
+# Observations" (2005), table 1: (L*, a*, b*) for each color of a pair and
+# their Delta E 2000.
+sharma_pairs = [
+    ((50.0000, 2.6772, -79.7751), (50.0000, 0.0000, -82.7485), 2.0425),
+    ((50.0000, 3.1571, -77.2803), (50.0000, 0.0000, -82.7485), 2.8615),
+    ((50.0000, 2.8361, -74.0200), (50.0000, 0.0000, -82.7485), 3.4412),
+    ((50.0000, -1.3802, -84.2814), (50.0000, 0.0000, -82.7485), 1.0000),
+    ((50.0000, -1.1848, -84.8006), (50.0000, 0.0000, -82.7485), 1.0000),
+    ((50.0000, -0.9009, -85.5211), (50.0000, 0.0000, -82.7485), 1.0000),
+    ((50.0000, 0.0000, 0.0000), (50.0000, -1.0000, 2.0000), 2.3669),
+    ((50.0000, -1.0000, 2.0000), (50.0000, 0.0000, 0.0000), 2.3669),
+    ((50.0000, 2.4900, -0.0010), (50.0000, -2.4900, 0.0009), 7.1792),
+    ((50.0000, 2.4900, -0.0010), (50.0000, -2.4900, 0.0010), 7.1792),
+    ((50.0000, 2.4900, -0.0010), (50.0000, -2.4900, 0.0011), 7.2195),
+    ((50.0000, 2.4900, -0.0010), (50.0000, -2.4900, 0.0012), 7.2195),
+    ((50.0000, -0.0010, 2.4900), (50.0000, 0.0009, -2.4900), 4.8045),
+    ((50.0000, -0.0010, 2.4900), (50.0000, 0.0010, -2.4900), 4.8045),
+    ((50.0000, -0.0010, 2.4900), (50.0000, 0.0011, -2.4900), 4.7461),
+    ((50.0000, 2.5000, 0.0000), (50.0000, 0.0000, -2.5000), 4.3065),
+    ((50.0000, 2.5000, 0.0000), (73.0000, 25.0000, -18.0000), 27.1492),
+    ((50.0000, 2.5000, 0.0000), (61.0000, -5.0000, 29.0000), 22.8977),
+    ((50.0000, 2.5000, 0.0000), (56.0000, -27.0000, -3.0000), 31.9030),
+    ((50.0000, 2.5000, 0.0000), (58.0000, 24.0000, 15.0000), 19.4535),
+    ((50.0000, 2.5000, 0.0000), (50.0000, 3.1736, 0.5854), 1.0000),
+    ((50.0000, 2.5000, 0.0000), (50.0000, 3.2972, 0.0000), 1.0000),
+    ((50.0000, 2.5000, 0.0000), (50.0000, 1.8634, 0.5757), 1.0000),
+    ((50.0000, 2.5000, 0.0000), (50.0000, 3.2592, 0.3350), 1.0000),
+    ((60.2574, -34.0099, 36.2677), (60.4626, -34.1751, 39.4387), 1.2644),
+    ((63.0109, -31.0961, -5.8663), (62.8187, -29.7946, -4.0864), 1.2630),
+    ((61.2901, 3.7196, -5.3901), (61.4292, 2.2480, -4.9620), 1.8731),
+    ((35.0831, -44.1164, 3.7933), (35.0232, -40.0716, 1.5901), 1.8645),
+    ((22.7233, 20.0904, -46.6940), (23.0331, 14.9730, -42.5619), 2.0373),
+    ((36.4612, 47.8580, 18.3852), (36.2715, 50.5065, 21.2231), 1.4146),
+    ((90.8027, -2.0831, 1.4410), (91.1528, -1.6435, 0.0447), 1.4441),
+    ((90.9257, -0.5406, -0.9208), (88.6381, -0.8985, -0.7239), 1.5381),
+    ((6.7747, -0.2908, -2.4247), (5.8714, -0.0985, -2.2286), 0.6377),
+    ((2.0776, 0.0795, -1.1350), (0.9033, -0.0636, -0.5514), 0.9082),
+]
+
+def ciede2000_coordinates(lab):
+    (l, a, b) = lab
+    return (l, a, b, math.hypot(a, b))
+
+class MetricTest(unittest.TestCase):
+    def test_ciede2000_reference(self):
+        metric = color.get_metric('ciede2000')
+        for (lab1, lab2, expected) in sharma_pairs:
+            coords1 = ciede2000_coordinates(lab1)
+            coords2 = ciede2000_coordinates(lab2)
+            self.assertAlmostEqual(metric.distance(coords1, coords2),
+                                   expected, places=4)
+            self.assertAlmostEqual(metric.distance(coords2, coords1),
+                                   expected, places=4)
+
+    @unittest.skipIf(color.numpy is None, 'NumPy is not installed')
+    def test_ciede2000_reference_array(self):
+        metric = color.get_metric('ciede2000')
+        coords1 = color.numpy.array([ciede2000_coordinates(lab1)
+                                     for (lab1, lab2, expected)
+                                     in sharma_pairs])
+        coords2 = color.numpy.array([ciede2000_coordinates(lab2)
+                                     for (lab1, lab2, expected)
+                                     in sharma_pairs])
+        dists = metric.array_distance(coords1, coords2).tolist()
+        for (dist, (lab1, lab2, expected)) in zip(dists, sharma_pairs):
+            self.assertAlmostEqual(dist, expected, places=4)
+
+    def test_lab(self):
+        for (rgb, lab) in (((0, 0, 0), (0, 0, 0)),
+                           ((255, 255, 255), (100, 0, 0)),
+                           ((255, 0, 0), (53.2408, 80.0925, 67.2032))):
+            for (got, expected) in zip(color._rgb_to_lab(*rgb), lab):
+                self.assertAlmostEqual(got, expected, places=2)
+
+    def test_squared(self):
+        self.assertEqual([name for name in color.metric_names()
+                          if not color.get_metric(name).squared],
+                         ['ciede2000'])
+
+    def test_nearest(self):
+        # nearest() against measuring every entry, and nearest_many() with
+        # and without NumPy against nearest().
+        colors = [color.Color(*rgb)
+                  for rgb in random_rgbs(100, seed=3) + edge_rgbs[:20]]
+        for palette in color.palette_names():
+            for name in color.metric_names():
+                metric = color.get_metric(name, palette)
+                for c in colors:
+                    coords = metric.convert(c.red, c.green, c.blue)
+                    dists = [(metric.distance(coords, other), rank, xterm)
+                             for (rank, (xterm, other))
+                             in enumerate(metric.coordinates())]
+                    self.assertEqual(metric.nearest(c), min(dists)[2],
+                                     '%s %s %r' % (palette, name, c))
+                expected = [metric.nearest(c) for c in colors]
+                self.assertEqual(metric.nearest_many(colors, use_numpy=False),
+                                 expected)
+                if color.numpy is not None:
+                    self.assertEqual(
+                        metric.nearest_many(colors, use_numpy=True),
+                        expected, '%s %s' % (palette, name))
+
+    def test_unknown_metric(self):
+        self.assertRaises(ValueError, color.get_metric, 'no-such-metric')
+
+class ColorTest(unittest.TestCase):
+    def test_identity(self):
+        c = color.Color(0x12, 0x34, 0x56)
+        self.assertTrue(color.Color(0x12, 0x34, 0x56) is c)
+        self.assertTrue(color.Color.from_string('#123456') is c)
+        self.assertTrue(color.Color.from_string('123456') is c)
+        self.assertTrue(color.Color.from_string('white') is
+                        color.Color(255, 255, 255))
+        self.assertEqual(c.rgb, 0x123456)
+        self.assertEqual(hash(c), 0x123456)
+        self.assertEqual(c, color.Color(0x12, 0x34, 0x56))
+        self.assertNotEqual(c, color.Color(0x12, 0x34, 0x57))
+        self.assertFalse(c != color.Color(0x12, 0x34, 0x56))
+        self.assertNotEqual(c, (0x12, 0x34, 0x56))
+        self.assertEqual(len(set([c, color.Color(0x12, 0x34, 0x56)])), 1)
+
+    def test_bad_values(self):
+        for rgb in ((256, 0, 0), (0, -1, 0), (0, 0, 1000)):
+            self.assertRaises(ValueError, color.Color, *rgb)
+        self.assertRaises(ValueError, color.Color.from_string, '#12345')
+        self.assertRaises(ValueError, color.Color.from_string, 'no such color')
+
+    def test_immutable(self):
+        c = color.Color(1, 2, 3)
+        for name in ('red', 'green', 'blue', 'rgb', 'other'):
+            self.assertRaises(AttributeError, setattr, c, name, 0)
+        self.assertRaises(AttributeError, delattr, c, 'red')
+        self.assertFalse(hasattr(c, '__dict__'))
+        self.assertEqual((c.red, c.green, c.blue, c.rgb), (1, 2, 3, 0x010203))
+
+    def test_pickle(self):
+        c = color.Color(0xfe, 0x80, 0x01)
+        for module in (pickle, cPickle):
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                copy = module.loads(module.dumps(c, protocol))
+                self.assertTrue(copy is c, '%s %d' % (module.__name__,
+                                                      protocol))
+                copies = module.loads(module.dumps([c, c], protocol))
+                self.assertTrue(copies[0] is c and copies[1] is c)
+
+class NameTableTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='color-test')
+        self.rgb_file = os.path.join(self.dir, 'rgb.txt')
+        self.table_file = os.path.join(self.dir, 'color-names.tbl')
+        self.write_rgb('255 250 250\t\tsnow\n  0   0 128\t\tNavy Blue\n')
+        self.extra_color_names = color._extra_color_names.copy()
+
+    def tearDown(self):
+        color._extra_color_names.clear()
+        color._extra_color_names.update(self.extra_color_names)
+        shutil.rmtree(self.dir)
+
+    def write_rgb(self, text):
+        f = open(self.rgb_file, 'w')
+        try:
+            f.write(text)
+        finally:
+            f.close()
+
+    def test_lookup(self):
+        table = color.NameTable(color.NameTable.generate(self.rgb_file))
+        self.assertTrue(table.get('snow') is color.Color(255, 250, 250))
+        self.assertTrue(table.get('navy blue') is color.Color(0, 0, 128))
+        self.assertTrue(table.get('darkyellow') is color.Color(0xbb, 0xbb, 0))
+        self.assertEqual(table.get('Snow'), None)
+        self.assertFalse('no such color' in table)
+
+    def test_source_changed(self):
+        data = color.NameTable.generate(self.rgb_file)
+        self.write_rgb('255 250 250\t\tsnow\n')
+        # The size changed, whatever the timestamp's resolution.
+        self.assertRaises(ValueError, color.NameTable, data)
+
+        table = color.NameTable.load(self.table_file, self.rgb_file)
+        self.assertEqual(table.get('navy blue'), None)
+        self.write_rgb('255 250 250\t\tsnow\n  0   0 128\t\tnavy\n')
+        table = color.NameTable.load(self.table_file, self.rgb_file)
+        self.assertTrue(table.get('navy') is color.Color(0, 0, 128))
+
+    def test_extra_names_changed(self):
+        data = color.NameTable.generate(self.rgb_file)
+        color._extra_color_names['lightyellow2'] = color.Color(1, 2, 3)
+        self.assertRaises(ValueError, color.NameTable, data)
+        table = color.NameTable(color.NameTable.generate(self.rgb_file))
+        self.assertTrue(table.get('lightyellow2') is color.Color(1, 2, 3))
+
+    def test_source_gone(self):
+        # Without the source, the old table is better than nothing.
+        color.NameTable.load(self.table_file, self.rgb_file)
+        os.remove(self.rgb_file)
+        stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            table = color.NameTable.load(self.table_file, self.rgb_file)
+            warning = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertTrue(table.get('snow') is color.Color(255, 250, 250))
+        self.assertTrue(warning.startswith('Warning: using the out of date'))
+
+if __name__ == '__main__':
+    unittest.main()
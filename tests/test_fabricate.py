@@ -0,0 +1,244 @@
+# Copyright 2010 Kevin Goodsell
+#
+# This file is part of vim-xterm-colors.
+#
+# vim-xterm-colors is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License Version 2
+# as published by the Free Software Foundation.
+#
+# vim-xterm-colors is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with vim-xterm-colors.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+# Run with 'python -m unittest discover tests' from the top directory.
+
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+import fabricate
+
+class DepsJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='fabricate-test')
+        self.filename = os.path.join(self.dir, '.deps')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def header(self):
+        return fabricate.DepsJournal(self.filename)._header()
+
+    def write_journal(self, commands):
+        journal = fabricate.DepsJournal(self.filename)
+        for command in commands:
+            journal[command] = {'input': 'hash of ' + command}
+        journal.discard()
+
+    def truncate(self, size):
+        f = open(self.filename, 'r+b')
+        try:
+            f.truncate(size)
+        finally:
+            f.close()
+
+    def check_append_after_crash(self, size):
+        # A crash left the journal cut off at size. The next run should
+        # keep the header and append after it.
+        self.write_journal(['cmd a'])
+        self.truncate(size)
+
+        journal = fabricate.DepsJournal(self.filename)
+        self.assertFalse(journal.bad_version)
+        self.assertEqual(len(journal), 0)
+        journal['cmd b'] = {'input': 'hash of cmd b'}
+        journal.discard()
+
+        journal = fabricate.DepsJournal(self.filename)
+        self.assertFalse(journal.bad_version)
+        self.assertEqual(journal.keys(), ['cmd b'])
+        self.assertEqual(journal['cmd b'], {'input': 'hash of cmd b'})
+        journal.discard()
+
+    def test_header_only(self):
+        self.check_append_after_crash(len(self.header()))
+
+    def test_partial_first_record(self):
+        self.write_journal(['cmd a'])
+        full = os.path.getsize(self.filename)
+        header = len(self.header())
+        self.check_append_after_crash(header + (full - header) // 2)
+
+    def test_partial_later_record(self):
+        self.write_journal(['cmd a', 'cmd c'])
+        full = os.path.getsize(self.filename)
+        self.truncate(full - 3)
+
+        journal = fabricate.DepsJournal(self.filename)
+        self.assertEqual(journal.keys(), ['cmd a'])
+        journal['cmd b'] = {'input': 'hash of cmd b'}
+        journal.discard()
+
+        journal = fabricate.DepsJournal(self.filename)
+        self.assertEqual(sorted(journal.keys()), ['cmd a', 'cmd b'])
+        journal.discard()
+
+class HashMemoTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp(prefix='fabricate-test')
+        os.chdir(self.dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def write(self, filename, data):
+        f = open(filename, 'w')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+
+    def test_spellings_share_hash(self):
+        builder = fabricate.Builder(runner=lambda *args: None, quiet=True,
+                                    hasher=fabricate.md5_hasher)
+        self.write('x', 'one')
+        first = builder.hash('./x')
+        self.assertEqual(builder.hash('x'), first)
+
+        self.write('x', 'two')
+        builder.forget_hashes(['x'])
+        self.assertNotEqual(builder.hash('./x'), first)
+        self.assertEqual(builder.hash('./x'), builder.hash('x'))
+
+class ArtifactCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp(prefix='fabricate-test')
+        self.outside = tempfile.mkdtemp(prefix='fabricate-test')
+        os.chdir(self.dir)
+        self.cache = fabricate.ArtifactCache('cache')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+        shutil.rmtree(self.outside)
+
+    def write(self, filename, data):
+        f = open(filename, 'w')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+
+    def test_paths(self):
+        library = os.path.join(self.outside, 'library')
+        self.write(library, 'library')
+        self.write('input', 'input')
+        self.write('output', 'output')
+        hasher = fabricate.md5_hasher
+        self.cache.store('cmd', {
+            os.path.join(self.dir, 'input'): 'input-' + hasher('input'),
+            library: 'input-' + hasher(library),
+            './output': 'output-' + hasher('output'),
+        })
+
+        os.remove('output')
+        entry = self.cache.lookup('cmd', hasher)
+        self.assertEqual(sorted(entry['inputs']), sorted(['input', library]))
+        self.assertEqual(entry['outputs'].keys(), ['output'])
+        self.assertEqual(open('output').read(), 'output')
+
+class BatchRunner(fabricate.Runner):
+    # Writes each command's output and a cache file that no command names,
+    # as a program run by run_batch() might.
+    def __init__(self, builder):
+        self._builder = builder
+
+    def __call__(self, *args):
+        for name in ('a.out', 'b.out', 'cache.tbl'):
+            f = open(name, 'w')
+            try:
+                f.write(name)
+            finally:
+                f.close()
+        return (['prog', 'a.in', 'b.in'], ['a.out', 'b.out', 'cache.tbl'])
+
+class RunBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp(prefix='fabricate-test')
+        os.chdir(self.dir)
+        for name in ('prog', 'a.in', 'b.in'):
+            open(name, 'w').close()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def test_unnamed_files(self):
+        builder = fabricate.Builder(runner=BatchRunner, quiet=True)
+        builder.run_batch(['prog', '--batch'],
+                          [['prog', 'a.in', '-o', 'a.out'],
+                           ['prog', 'b.in', '-o', 'b.out']])
+
+        deps = builder.deps['prog a.in -o a.out']
+        self.assertEqual(sorted(deps), ['a.in', 'a.out', 'prog'])
+        self.assertTrue(deps['a.out'].startswith('output-'))
+        deps = builder.deps['prog b.in -o b.out']
+        self.assertEqual(sorted(deps), ['b.in', 'b.out', 'prog'])
+
+        builder.autoclean()
+        self.assertFalse(os.path.exists('a.out'))
+        self.assertFalse(os.path.exists('b.out'))
+        self.assertTrue(os.path.exists('cache.tbl'))
+
+class StraceParseTest(unittest.TestCase):
+    def setUp(self):
+        # The parser is tested on canned output, so strace isn't needed.
+        self.get_strace_version = fabricate.StraceRunner.get_strace_version
+        fabricate.StraceRunner.get_strace_version = staticmethod(lambda: 64)
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp(prefix='fabricate-test')
+        os.chdir(self.dir)
+        builder = fabricate.Builder(runner=lambda *args: None, quiet=True)
+        self.runner = fabricate.StraceRunner(builder)
+
+    def tearDown(self):
+        fabricate.StraceRunner.get_strace_version = self.get_strace_version
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def parse(self, text):
+        (status, deps, outputs) = self.runner._parse_strace(
+            StringIO.StringIO(text))
+        return (status, sorted(deps), sorted(outputs))
+
+    def test_child_before_clone(self):
+        text = (
+            '100 execve("/bin/sh", ["sh"], [/* 1 vars */]) = 0\n'
+            '101 open("child.txt", O_RDONLY) = 3\n'
+            '101 chdir("sub") = 0\n'
+            '101 open("out.txt", O_WRONLY|O_CREAT, 0666) = 3\n'
+            '100 clone(child_stack=0, flags=SIGCHLD) = 101\n'
+            '100 open("parent.txt", O_RDONLY) = 3\n'
+            '102 <... open resumed> ) = 3\n'
+            '100 exit_group(2) = ?\n'
+        )
+        self.assertEqual(self.parse(text),
+                         (2, ['child.txt', 'parent.txt'],
+                          [os.path.join('.', 'sub', 'out.txt')]))
+
+if __name__ == '__main__':
+    unittest.main()